@@ -0,0 +1,279 @@
+"""
+Write-behind autosave with a crash-recovery journal.
+
+An AutoSaver watches TagTextEdits and collects the keys of the ones whose
+document changed. Once typing pauses for idle_ms, and at the latest
+max_delay_ms after the first unsaved change, it takes a snapshot of each
+changed editor with to_model_data() on the GUI thread and hands the model
+strings to a worker thread. The worker appends them to a Journal and syncs it
+to disk, so the GUI thread never waits for the disk. An editor whose last
+snapshot took longer than slow_snapshot_ms is only snapshot when typing
+pauses, so that a huge document rarely interrupts typing, but at the latest
+max_deferral_ms after its first unsaved change.
+
+A Journal is an append-only file of JSON lines, one (key, model string)
+record each, in which the last record of a key wins. When the file holds
+many more records than keys it is compacted by writing the latest record of
+each key to a new file, which replaces the old one. A record that was cut
+short by a crash is ignored when the journal is read back, and cut off when
+it is opened again, so that the next record starts on a line of its own.
+
+After a crash, AutoSaver.recovered holds the model strings found in the
+journal, to be put back into the segments before editing continues. Call
+clear() when the segments have been saved elsewhere.
+
+"""
+
+
+import functools
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from PyQt5.QtCore import QObject, QTimer
+
+logger = logging.getLogger(__name__)
+
+_CLEAR = object()
+_STOP = object()
+
+
+def read_journal(path):
+    """Return the latest model string of each key in the journal at path, and the number of records."""
+    entries = {}
+    records = 0
+    try:
+        f = open(path, encoding='utf-8')
+    except FileNotFoundError:
+        return entries, records
+    with f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # the tail of a journal that was being written when the program died
+                continue
+            entries[record['key']] = record['data']
+            records += 1
+    return entries, records
+
+
+def truncate_torn_tail(path, chunk_size=65536):
+    """Cut the file at path back to its last newline, removing a record cut short by a crash."""
+    try:
+        f = open(path, 'r+b')
+    except FileNotFoundError:
+        return
+    with f:
+        end = f.seek(0, os.SEEK_END)
+        position = end
+        while position > 0:
+            start = max(0, position - chunk_size)
+            f.seek(start)
+            newline = f.read(position - start).rfind(b'\n')
+            if newline != -1:
+                position = start + newline + 1
+                break
+            position = start
+        if position != end:
+            f.truncate(position)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class Journal:
+    """An append-only file of (key, model string) records."""
+    compact_ratio = 4
+    compact_minimum = 1024
+
+    def __init__(self, path):
+        self.path = path
+        self.entries, self.records = read_journal(path)
+        truncate_torn_tail(path)
+        self.file = None
+
+    def append(self, items):
+        """Append the (key, data) pairs in items and sync the file to disk."""
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        for key, data in items:
+            self.file.write(json.dumps({'key': key, 'data': data}, ensure_ascii=False) + '\n')
+            self.entries[key] = data
+            self.records += 1
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        if self.records > max(self.compact_minimum, self.compact_ratio * len(self.entries)):
+            self.compact()
+
+    def compact(self):
+        """Rewrite the journal with only the latest record of each key."""
+        self.close()
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w', encoding='utf-8') as f:
+            for key, data in self.entries.items():
+                f.write(json.dumps({'key': key, 'data': data}, ensure_ascii=False) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+        self.records = len(self.entries)
+
+    def clear(self):
+        self.close()
+        self.entries.clear()
+        self.records = 0
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class AutoSaver(QObject):
+    """Saves the model strings of changed editors to a journal from a worker thread."""
+    idle_ms = 500
+    max_delay_ms = 3000
+    slow_snapshot_ms = 16
+    max_deferral_ms = 2 * max_delay_ms
+
+    def __init__(self, path, parent=None):
+        super().__init__(parent)
+        self.journal = Journal(path)
+        self.recovered = dict(self.journal.entries)
+        self.editors = {}
+        self.dirty = {}
+        self.snapshot_costs = {}
+        self.first_change = None
+        self.last_change = None
+        self.deferred_since = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.on_timeout)
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name='autosave', daemon=True)
+        self.thread.start()
+
+    def watch(self, editor, key):
+        """Save the contents of editor under key whenever its document changes."""
+        slot = functools.partial(self.mark_dirty, editor)
+        self.editors[editor] = (key, slot)
+        editor.document().contentsChanged.connect(slot)
+
+    def unwatch(self, editor):
+        """Stop watching editor, taking a snapshot first if it has unsaved changes."""
+        key, slot = self.editors.pop(editor)
+        editor.document().contentsChanged.disconnect(slot)
+        if self.dirty.get(key) is editor:
+            self.dirty[key] = editor.to_model_data()
+
+    def mark_dirty(self, editor):
+        self.dirty[self.editors[editor][0]] = editor
+        self.schedule()
+
+    def record(self, key, data):
+        """Save the model string data under key."""
+        self.dirty[key] = data
+        self.schedule()
+
+    def schedule(self):
+        now = self.last_change = time.monotonic()
+        if self.first_change is None:
+            self.first_change = now
+        self.start_timer(now)
+
+    def start_timer(self, now):
+        """Start the timer for idle_ms, or less if the snapshot of a change is due sooner."""
+        remaining = [self.idle_ms]
+        if self.first_change is not None:
+            remaining.append(self.max_delay_ms - (now - self.first_change) * 1000)
+        if self.deferred_since is not None:
+            remaining.append(self.max_deferral_ms - (now - self.deferred_since) * 1000)
+        self.timer.start(max(0, int(min(remaining))))
+
+    def on_timeout(self):
+        now = time.monotonic()
+        typing = (now - self.last_change) * 1000 < self.idle_ms
+        overdue = self.deferred_since is not None and (now - self.deferred_since) * 1000 >= self.max_deferral_ms
+        self.flush(skip_slow=typing and not overdue)
+
+    def flush(self, skip_slow=False):
+        """Take a snapshot of the changed editors and queue it for the worker thread.
+
+        If skip_slow is True, the editors with slow snapshots are left for
+        the next time typing pauses, or until max_deferral_ms have passed.
+
+        """
+        self.timer.stop()
+        items = []
+        deferred = {}
+        for key, value in self.dirty.items():
+            if not isinstance(value, str):
+                if skip_slow and self.snapshot_costs.get(key, 0) * 1000 > self.slow_snapshot_ms:
+                    deferred[key] = value
+                    continue
+                start = time.perf_counter()
+                try:
+                    value = value.to_model_data()
+                except RuntimeError:
+                    # the editor was deleted without being unwatched
+                    continue
+                self.snapshot_costs[key] = time.perf_counter() - start
+            items.append((key, value))
+        self.dirty = deferred
+        if not deferred:
+            self.deferred_since = None
+        elif self.deferred_since is None:
+            self.deferred_since = self.first_change if self.first_change is not None else time.monotonic()
+        # the other changes are saved, so max_delay_ms starts again with the next change
+        self.first_change = None
+        if deferred:
+            self.start_timer(time.monotonic())
+        if items:
+            self.queue.put(items)
+
+    def clear(self):
+        """Forget all unsaved changes and remove the journal, after the segments were saved."""
+        self.timer.stop()
+        self.first_change = None
+        self.deferred_since = None
+        self.dirty.clear()
+        self.recovered.clear()
+        self.queue.put(_CLEAR)
+
+    def close(self):
+        """Write the remaining changes and stop the worker thread."""
+        self.flush()
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    def run(self):
+        journal = self.journal
+        while True:
+            item = self.queue.get()
+            # write everything that was queued while the last batch was written at once
+            items = []
+            while True:
+                if item is _STOP or item is _CLEAR:
+                    break
+                items.extend(item)
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    item = None
+                    break
+            try:
+                if items:
+                    journal.append(items)
+                if item is _CLEAR:
+                    journal.clear()
+            except OSError:
+                logger.exception('autosave to %s failed', journal.path)
+            if item is _STOP:
+                journal.close()
+                return
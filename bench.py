@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the editor hot paths.
+
+Runs offscreen (QT_QPA_PLATFORM defaults to offscreen) against generated
+segments of configurable length and tag density, and reports latency
+percentiles and throughput for each benchmark. Results can be saved as a
+baseline and later runs compared against it; a benchmark whose median is
+slower than the baseline by more than the threshold counts as a regression
+and makes the run exit with status 1.
+
+usage: bench.py [--length N] [--tag-density N] [--repeat N] [--only NAME ...]
+                [--save-baseline FILE] [--baseline FILE] [--threshold F]
+
+"""
+
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PyQt5.QtCore import QMimeData, QRectF
+from PyQt5.QtGui import QImage, QPainter, QTextCursor
+from PyQt5.QtWidgets import QApplication
+
+from main import ChunkedPaste, ExampleWindow, TagTextObject
+from wordboundary import BoundaryHandler, word_spans
+
+WORDS = ('translation', 'segment', 'の', '翻訳', 'メモリ', 'editor', 'tag', 'a', 'of', '文章', 'value', '42')
+
+BENCHMARKS = {}
+
+
+def benchmark(name):
+    """Register a benchmark. It is called with the window and the options and returns the operation to time."""
+    def register(setup):
+        BENCHMARKS[name] = setup
+        return setup
+    return register
+
+
+def generate_segment(length, tag_density, seed=0):
+    """Return a model string of about length characters with tag_density tags per 100 characters."""
+    rng = random.Random(seed)
+    parts = []
+    size = 0
+    name = 0
+    open_tags = []
+    tags = 0
+    while size < length:
+        if size * tag_density / 100 > tags:
+            tags += 1
+            if open_tags and rng.random() < 0.5:
+                parts.append(f'<{open_tags.pop()}}}')
+            elif rng.random() < 0.5:
+                name = name % 99 + 1
+                open_tags.append(name)
+                parts.append(f'{{{name}>')
+            else:
+                name = name % 99 + 1
+                parts.append(f'{{{name}}}')
+            size += 1
+        word = rng.choice(WORDS)
+        parts.append(word + ' ')
+        size += len(word) + 1
+    parts.extend(f'<{name}}}' for name in reversed(open_tags))
+    return ''.join(parts)
+
+
+def load(window, options):
+    window.tageditor.from_model_data(generate_segment(options.length, options.tag_density))
+    return window.tageditor
+
+
+@benchmark('to_model_data_in_range')
+def bench_to_model_data(window, options):
+    editor = load(window, options)
+    end = editor.document().characterCount() - 1
+    return lambda: editor.to_model_data_in_range(0, end)
+
+
+@benchmark('on_text_changed')
+def bench_on_text_changed(window, options):
+    editor = load(window, options)
+    cursor = QTextCursor(editor.document())
+    cursor.setPosition(editor.document().characterCount() // 2)
+
+    def run():
+        # a keystroke followed by the rescan it triggers
+        cursor.insertText('x')
+        cursor.deletePreviousChar()
+    return run
+
+
+@benchmark('on_text_changed_tag')
+def bench_on_text_changed_tag(window, options):
+    editor = load(window, options)
+    cursor = QTextCursor(editor.document())
+    cursor.setPosition(editor.document().characterCount() // 2)
+
+    def run():
+        # typing the last character of a tag converts it
+        cursor.insertText('{1')
+        cursor.insertText('}')
+        cursor.deletePreviousChar()
+    return run
+
+
+def word_benchmark(operation):
+    def setup(window, options):
+        editor = load(window, options)
+        handler = window.mouse_event_filter
+        cursor = QTextCursor(editor.document())
+        positions = list(range(0, editor.document().characterCount() - 1, 7))
+
+        def run():
+            for position in positions:
+                cursor.setPosition(position)
+                handler.move(cursor, operation)
+        return run
+    return setup
+
+
+for _name, _operation in (('StartOfWord', QTextCursor.StartOfWord), ('EndOfWord', QTextCursor.EndOfWord),
+                          ('PreviousWord', QTextCursor.PreviousWord), ('NextWord', QTextCursor.NextWord),
+                          ('WordLeft', QTextCursor.WordLeft), ('WordRight', QTextCursor.WordRight)):
+    benchmark(f'BoundaryHandler.move.{_name}')(word_benchmark(_operation))
+
+
+def block_texts(window, options):
+    doc = load(window, options).document()
+    texts = []
+    block = doc.begin()
+    while block.isValid():
+        texts.append(block.text())
+        block = block.next()
+    return texts
+
+
+@benchmark('word_segmentation.regex')
+def bench_word_regexp(window, options):
+    texts = block_texts(window, options)
+    finditer = BoundaryHandler.word_regexp.finditer
+    return lambda: [[m.span() for m in finditer(text) if not m.group(0).isspace()] for text in texts]
+
+
+@benchmark('word_segmentation.table')
+def bench_word_table(window, options):
+    texts = block_texts(window, options)
+    return lambda: [word_spans(text) for text in texts]
+
+
+@benchmark('layout')
+def bench_layout(window, options):
+    editor = load(window, options)
+    doc = editor.document()
+
+    def run():
+        # relayout the whole document, sizing every tag
+        doc.markContentsDirty(0, doc.characterCount())
+        doc.documentLayout().documentSize()
+    return run
+
+
+@benchmark('paint')
+def bench_paint(window, options):
+    editor = load(window, options)
+    viewport = editor.viewport()
+    image = QImage(viewport.size(), QImage.Format_ARGB32_Premultiplied)
+    return lambda: viewport.render(image)
+
+
+@benchmark('TagTextObject.intrinsicSize')
+def bench_intrinsic_size(window, options):
+    editor = load(window, options)
+    doc = editor.document()
+    formats = tag_formats(doc)
+    handler = window.tag_object
+    return lambda: [handler.intrinsicSize(doc, pos, char_format) for pos, char_format in formats]
+
+
+@benchmark('TagTextObject.drawObject')
+def bench_draw_object(window, options):
+    editor = load(window, options)
+    doc = editor.document()
+    formats = tag_formats(doc)
+    handler = window.tag_object
+    image = QImage(200, 50, QImage.Format_ARGB32_Premultiplied)
+    rect = QRectF(10, 10, 24, 22)
+
+    def run():
+        painter = QPainter(image)
+        for pos, char_format in formats:
+            handler.drawObject(painter, rect, doc, pos, char_format)
+        painter.end()
+    return run
+
+
+@benchmark('insertFromMimeData')
+def bench_paste(window, options):
+    editor = window.tageditor
+    mime = QMimeData()
+    mime.setText(generate_segment(options.length, options.tag_density, seed=1))
+
+    def run():
+        editor.from_model_data('')
+        editor.insertFromMimeData(mime)
+        # a long paste continues from the event loop
+        while editor.clipboard_job is not None:
+            QApplication.processEvents()
+    return run
+
+
+@benchmark('ChunkedPaste.step')
+def bench_paste_step(window, options):
+    editor = window.tageditor
+    text = generate_segment(options.length, options.tag_density, seed=1)
+
+    def run():
+        # the longest the event loop waits for while pasting
+        editor.from_model_data('')
+        job = ChunkedPaste(editor, editor.textCursor(), text)
+        job.step()
+    return run
+
+
+def tag_formats(doc):
+    formats = []
+    block = doc.begin()
+    while block.isValid():
+        it = block.begin()
+        while not it.atEnd():
+            fragment = it.fragment()
+            if fragment.charFormat().objectType() == TagTextObject.type:
+                formats.append((fragment.position(), fragment.charFormat()))
+            it += 1
+        block = block.next()
+    return formats
+
+
+def measure(operation, repeat, warmup=3):
+    for _ in range(warmup):
+        operation()
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def percentile(sorted_values, fraction):
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(timings):
+    timings = sorted(timings)
+    return {
+        'p50_ms': percentile(timings, 0.5) * 1000,
+        'p90_ms': percentile(timings, 0.9) * 1000,
+        'p99_ms': percentile(timings, 0.99) * 1000,
+        'mean_ms': statistics.fmean(timings) * 1000,
+        'ops_per_s': len(timings) / sum(timings) if sum(timings) else float('inf'),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the editor hot paths.')
+    parser.add_argument('--length', type=int, default=5000, help='characters per generated segment')
+    parser.add_argument('--tag-density', type=float, default=5, help='tags per 100 characters')
+    parser.add_argument('--repeat', type=int, default=50, help='timed runs per benchmark')
+    parser.add_argument('--only', nargs='*', metavar='NAME', help='run the benchmarks whose names start with NAME')
+    parser.add_argument('--save-baseline', metavar='FILE', help='write the results to FILE')
+    parser.add_argument('--baseline', metavar='FILE', help='compare the results with FILE')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown of the median (0.2 = 20%%)')
+    options = parser.parse_args(argv)
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    window = ExampleWindow()
+    window.resize(800, 600)
+    window.show()
+    app.processEvents()
+
+    baseline = {}
+    if options.baseline:
+        with open(options.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)['results']
+
+    results = {}
+    regressions = []
+    print(f'{"benchmark":40} {"p50 ms":>10} {"p90 ms":>10} {"p99 ms":>10} {"ops/s":>10} {"vs base":>8}')
+    for name, setup in BENCHMARKS.items():
+        if options.only and not any(name.startswith(prefix) for prefix in options.only):
+            continue
+        result = results[name] = summarize(measure(setup(window, options), options.repeat))
+        comparison = ''
+        if name in baseline:
+            ratio = result['p50_ms'] / baseline[name]['p50_ms'] if baseline[name]['p50_ms'] else 1.0
+            comparison = f'{ratio:7.2f}x'
+            if ratio > 1 + options.threshold:
+                regressions.append(name)
+                comparison += '!'
+        print(f'{name:40} {result["p50_ms"]:10.3f} {result["p90_ms"]:10.3f} {result["p99_ms"]:10.3f} '
+              f'{result["ops_per_s"]:10.1f} {comparison:>8}')
+
+    if options.save_baseline:
+        with open(options.save_baseline, 'w', encoding='utf-8') as f:
+            json.dump({'length': options.length, 'tag_density': options.tag_density, 'results': results}, f,
+                      indent=2)
+    if regressions:
+        print('regressions: ' + ', '.join(regressions))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
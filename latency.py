@@ -0,0 +1,228 @@
+"""
+Opt-in keystroke-to-paint latency instrumentation.
+
+Call enable() to install a LatencyMonitor as the module-wide monitor. While
+no monitor is installed the instrumented code paths only check that monitor
+is None, so the instrumentation costs next to nothing when disabled.
+
+An event starts when KeyEventFilter sees a key press and finishes when the
+editor has painted next. A key that does not repaint the editor, such as one
+that is dropped, finishes its event once the event loop has handled what the
+key posted. The time spent in each stage during an event is
+summed, and per-event totals are kept in rolling histograms per stage, along
+with the end-to-end latency. Stages nest: the paint event includes the
+drawObject calls made while painting. Events slower than the budget are
+logged and reported through the budget_exceeded signal.
+
+Set the TAGEDITOR_LATENCY environment variable to a file name to enable the
+monitor with a periodic JSON dump when running main.py.
+
+A FirstPaintTimer measures the time from a start time, such as the start of
+the program, to the end of the first paint of a widget. Set the
+TAGEDITOR_STARTUP environment variable to report the time to first paint of
+main.py or segmentview.py, or to 'quit' to quit right after reporting it.
+
+"""
+
+
+from collections import deque
+import functools
+import json
+import logging
+import sys
+import time
+
+from PyQt5.QtCore import QCoreApplication, QEvent, QObject, Qt, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QApplication
+
+KEY_FILTER = 'KeyEventFilter.eventFilter'
+WORD_KEYS = 'BoundaryHandler.keyPressEvent'
+RECOGNITION = 'on_text_changed'
+LAYOUT = 'TagTextObject.intrinsicSize'
+DRAW = 'TagTextObject.drawObject'
+PAINT = 'paintEvent'
+TOTAL = 'total'
+
+logger = logging.getLogger(__name__)
+
+monitor = None
+
+
+class _IdleEvent(QEvent):
+    """Posted to a LatencyMonitor after the events caused by the key of event serial."""
+    type_ = QEvent.Type(QEvent.registerEventType())
+
+    def __init__(self, serial):
+        super().__init__(self.type_)
+        self.serial = serial
+
+
+class LatencyMonitor(QObject):
+    budget_exceeded = pyqtSignal(dict)
+
+    def __init__(self, budget_ms=50.0, samples=1024, parent=None):
+        super().__init__(parent)
+        self.budget = budget_ms / 1000
+        self.samples = samples
+        self.histograms = {}
+        self.event_start = None
+        self.event_stages = {}
+        self.event_serial = 0
+        self.events = 0
+        self.over_budget = 0
+        self.dump_timer = None
+        self.dump_path = None
+
+    def call(self, stage, function, *args):
+        """Call function with args, recording the time it takes under stage."""
+        start = time.perf_counter()
+        try:
+            return function(*args)
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def record(self, stage, seconds):
+        if self.event_start is not None:
+            self.event_stages[stage] = self.event_stages.get(stage, 0.0) + seconds
+        else:
+            self.add_sample(stage, seconds)
+
+    def add_sample(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            histogram = self.histograms[stage] = deque(maxlen=self.samples)
+        histogram.append(seconds)
+
+    def begin_event(self):
+        if self.event_start is not None:
+            self.finish_event()
+        self.event_start = time.perf_counter()
+        self.event_stages = {}
+        self.event_serial += 1
+        QTimer.singleShot(0, functools.partial(self.post_idle, self.event_serial))
+
+    def post_idle(self, serial):
+        # the key has been handled by now and the update of the editor posted, with the same low priority,
+        # so the idle event is delivered after the paint
+        QCoreApplication.postEvent(self, _IdleEvent(serial), Qt.LowEventPriority)
+
+    def event(self, event):
+        if event.type() == _IdleEvent.type_:
+            # the key did not repaint the editor, or the paint already finished its event
+            if event.serial == self.event_serial:
+                self.finish_event()
+            return True
+        return super().event(event)
+
+    def finish_event(self):
+        if self.event_start is None:
+            return
+        total = time.perf_counter() - self.event_start
+        self.event_start = None
+        for stage, seconds in self.event_stages.items():
+            self.add_sample(stage, seconds)
+        self.add_sample(TOTAL, total)
+        self.events += 1
+        if total > self.budget:
+            self.over_budget += 1
+            report = {'total_ms': total * 1000,
+                      'stages_ms': {stage: seconds * 1000 for stage, seconds in self.event_stages.items()}}
+            logger.warning('keystroke took %.1f ms (budget %.1f ms): %s', total * 1000, self.budget * 1000,
+                           report['stages_ms'])
+            self.budget_exceeded.emit(report)
+
+    def snapshot(self):
+        """Return the current histograms as a dict of per-stage statistics in milliseconds."""
+        stages = {}
+        for stage, histogram in self.histograms.items():
+            values = sorted(histogram)
+            if not values:
+                continue
+            stages[stage] = {
+                'count': len(values),
+                'mean_ms': sum(values) / len(values) * 1000,
+                'p50_ms': _percentile(values, 0.5) * 1000,
+                'p90_ms': _percentile(values, 0.9) * 1000,
+                'p99_ms': _percentile(values, 0.99) * 1000,
+                'max_ms': values[-1] * 1000,
+            }
+        return {'events': self.events, 'over_budget': self.over_budget, 'budget_ms': self.budget * 1000,
+                'stages': stages}
+
+    def dump(self, path=None):
+        """Write the snapshot as JSON to path, or log it if there is no path."""
+        path = path or self.dump_path
+        data = self.snapshot()
+        if path is None:
+            logger.info('latency: %s', json.dumps(data))
+            return
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+
+    def start_dumping(self, interval_ms, path=None):
+        self.dump_path = path
+        if self.dump_timer is None:
+            self.dump_timer = QTimer(self)
+            self.dump_timer.timeout.connect(self.dump)
+        self.dump_timer.start(interval_ms)
+
+    def stop_dumping(self):
+        if self.dump_timer is not None:
+            self.dump_timer.stop()
+
+
+class FirstPaintTimer(QObject):
+    """Emits painted with the seconds from start to the end of the first paint of widget.
+
+    start is a time.perf_counter() value and defaults to now.
+    """
+    painted = pyqtSignal(float)
+
+    def __init__(self, widget, start=None, parent=None):
+        super().__init__(parent)
+        self.widget = widget
+        self.start = time.perf_counter() if start is None else start
+        self.elapsed = None
+        widget.installEventFilter(self)
+
+    def eventFilter(self, obj, event):
+        if obj == self.widget and event.type() == QEvent.Paint:
+            self.widget.removeEventFilter(self)
+            # the paint event is done by the time the event loop runs the timer
+            QTimer.singleShot(0, self.report)
+        return False
+
+    def report(self):
+        self.elapsed = time.perf_counter() - self.start
+        logger.info('time to first paint: %.1f ms', self.elapsed * 1000)
+        self.painted.emit(self.elapsed)
+
+
+def report_startup(timer, mode):
+    """Print the time to first paint measured by timer to stderr, and quit if mode is 'quit'."""
+    def report(elapsed):
+        print(f'time to first paint: {elapsed * 1000:.1f} ms', file=sys.stderr)
+        if mode == 'quit':
+            QApplication.quit()
+    timer.painted.connect(report)
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, round(fraction * (len(sorted_values) - 1)))]
+
+
+def enable(budget_ms=50.0, interval_ms=0, path=None, samples=1024):
+    """Install and return a LatencyMonitor, dumping it every interval_ms if that is not 0."""
+    global monitor
+    disable()
+    monitor = LatencyMonitor(budget_ms, samples)
+    if interval_ms:
+        monitor.start_dumping(interval_ms, path)
+    return monitor
+
+
+def disable():
+    global monitor
+    if monitor is not None:
+        monitor.stop_dumping()
+    monitor = None
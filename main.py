@@ -1,44 +1,233 @@
 #!/usr/bin/env python3
-from enum import Enum, auto
-import uuid
-import pyperclip
+from startup import STARTED
+import abc
+from collections import OrderedDict
+from contextlib import contextmanager
+import itertools
+import re
 from PyQt5 import QtCore, QtGui
 from PyQt5.QtGui import QPen, QColor, QBrush, QLinearGradient, QPainter, QPainterPath, QTextOption, \
     QTextDocumentFragment
 from PyQt5.QtGui import QTextCursor
 from PyQt5.QtGui import QTextFormat
 from PyQt5.QtGui import QTextCharFormat
-from PyQt5.QtGui import QTextObjectInterface, QTextObject, QFontMetrics, QTextDocument, QKeySequence
+from PyQt5.QtGui import QTextObjectInterface, QTextObject, QFontMetrics, QTextDocument, QKeySequence, QPixmap
 from PyQt5.QtCore import Qt
-from PyQt5.QtCore import QObject, QEvent, QMimeData, QRect, QRectF
+from PyQt5.QtCore import QObject, QEvent, QMimeData, QRect, QRectF, QSizeF, QTimer, pyqtSignal
 from PyQt5.QtWidgets import QWidget
 from PyQt5.QtWidgets import QLineEdit, QPushButton, QLabel
 from PyQt5.QtWidgets import QTextEdit
 from PyQt5.QtWidgets import QVBoxLayout
 from PyQt5.QtWidgets import QApplication
 
+import latency
+from segment import Segment
+from tags import TagKind, default_grammar
 from wordboundary import BoundaryHandler
 
 OBJECT_REPLACEMENT_CHARACTER = 0xfffc
 LINE_SEPARATOR = 0x2028
 PARAGRAPH_SEPARATOR = 0x2029
+# extra characters rescanned around an edit and the tag names next to it, so that tags crossing the edit
+# boundary are recognized
+TAG_SCAN_MARGIN = 16
+# the characters of tag names, which have no length limit in the formatting, named, printf and ICU syntaxes
+_TAG_NAME_CHARACTER = re.compile(r'[\w.^$()-]')
 
 
-class TagKind(Enum):
-    START = auto()
-    END = auto()
-    EMPTY = auto()
+def _utf16_offset(text: str, index: int) -> int:
+    # convert a python string index into a document (UTF-16) offset
+    return len(text[:index].encode('utf-16-le', 'surrogatepass')) // 2
+
+
+def _utf16_slice(text: str, start: int, end: int, length: int) -> str:
+    # document positions count UTF-16 code units, python strings count code points
+    if len(text) == length:
+        return text[start:end]
+    data = text.encode('utf-16-le', 'surrogatepass')
+    return data[start * 2:end * 2].decode('utf-16-le', 'surrogatepass')
+
+
+def _block_fragments(block):
+    """Yield each fragment of block with the (name, kind) of its tags, or None if it is text.
+
+    Adjacent tags with an identical format share one fragment, so a tag fragment holds
+    fragment.length() tags.
+    """
+    it = block.begin()
+    while not it.atEnd():
+        fragment = it.fragment()
+        it += 1
+        char_format = fragment.charFormat()
+        if char_format.objectType() == TagTextObject.type:
+            yield fragment, (char_format.property(TagTextObject.name_propid),
+                             char_format.property(TagTextObject.kind_propid))
+        else:
+            yield fragment, None
+
+
+def fill_document(doc: QTextDocument, data: str, line_break: str = chr(LINE_SEPARATOR)) -> None:
+    """Replace the content of doc with the segment encoded in the model string data.
+
+    The line breaks of data are written as line_break, a line separator by default; a paragraph
+    separator makes each line a block of its own.
+    """
+    doc.clear()
+    cursor = QTextCursor(doc)
+    cursor.beginEditBlock()
+    text_format = QTextCharFormat()
+    tag_format = TagTextEdit.tag_format
+    pos = 0
+    for (start, end), kind, name in default_grammar.scan(data):
+        if start > pos:
+            cursor.insertText(data[pos:start].replace('\n', line_break), text_format)
+        cursor.insertText(chr(OBJECT_REPLACEMENT_CHARACTER), tag_format(name, kind))
+        pos = end
+    if pos < len(data):
+        cursor.insertText(data[pos:].replace('\n', line_break), text_format)
+    cursor.endEditBlock()
 
 
 class TagTextEdit(QTextEdit):
+    tag_formats = {}
+    # opt-in limit on the estimated bytes of the undo history, None for no limit; QTextDocument
+    # cannot drop only its oldest commands, so when the limit is exceeded the whole history is cleared
+    undo_budget = None
+    # estimated bytes per undo command on top of the two bytes per character it keeps
+    undo_command_cost = 64
+
     def __init__(self, parent=None):
         super(TagTextEdit, self).__init__(parent)
-        self.is_undoing = False
         self.setAcceptRichText(False)
         # self.setUndoRedoEnabled(False)
         option = QTextOption()
         option.setFlags(QTextOption.ShowTabsAndSpaces | QTextOption.ShowLineAndParagraphSeparators)
         self.document().setDefaultTextOption(option)
+        self.dirty_range = None
+        self.batching = 0
+        self.clipboard_job = None
+        self.block_tag_cache = {}
+        self.block_count = 1
+        self.undo_steps = 0
+        self.undone = False
+        self.undo_cost = 0
+        self.typing_end = None
+        # an edit block opened by keyPressEvent() or transaction() is being edited
+        self.in_edit_block = False
+        # the last change was made in such a block, so that tag conversion may join its undo step
+        self.joinable_edit = False
+        self.lazy_layout = False
+        self.line_break = chr(LINE_SEPARATOR)
+        self.extra_selection_groups = {}
+        self.document().contentsChange.connect(self.on_contents_change)
+
+    def on_contents_change(self, position: int, removed: int, added: int) -> None:
+        # edits never shrink the undo stack, so fewer undo steps than after the last change means an undo,
+        # whether it came from a shortcut, the context menu or QTextDocument.undo()
+        undo_steps = self.document().availableUndoSteps()
+        if undo_steps < self.undo_steps:
+            self.undone = True
+        elif self.document().isUndoRedoEnabled():
+            self.undo_cost += 2 * (removed + added) + self.undo_command_cost
+        self.undo_steps = undo_steps
+        self.invalidate_block_tags(position, added)
+        self.joinable_edit = self.in_edit_block
+        if not self.in_edit_block:
+            # an IME commit, a drop or a programmatic edit ends a run of typing
+            self.typing_end = None
+        # accumulate the range touched since the last tag recognition pass
+        change_end = position + added
+        if self.dirty_range is None:
+            self.dirty_range = (position, change_end)
+            return
+        start, end = self.dirty_range
+        if end >= position + removed:
+            end += added - removed
+        elif end > position:
+            end = change_end
+        self.dirty_range = (min(start, position), max(end, change_end))
+
+    def invalidate_block_tags(self, position: int, added: int) -> None:
+        """Drop the cached tags of the blocks a change touched, see block_tags().
+
+        If the change added or removed blocks, the blocks after it have been renumbered, so
+        their entries are dropped as well.
+        """
+        doc = self.document()
+        block_count = doc.blockCount()
+        if self.block_tag_cache:
+            first = doc.findBlock(position).blockNumber()
+            if block_count != self.block_count:
+                last = max(block_count, self.block_count)
+            else:
+                last = doc.findBlock(position + added).blockNumber()
+            for number in [number for number in self.block_tag_cache if first <= number <= last]:
+                del self.block_tag_cache[number]
+        self.block_count = block_count
+
+    def take_dirty_range(self):
+        dirty_range = self.dirty_range
+        self.dirty_range = None
+        self.undone = False
+        return dirty_range
+
+    def reset_undo_tracking(self):
+        """Start tracking the undo history afresh, after it has been cleared."""
+        self.undo_steps = self.document().availableUndoSteps()
+        self.undo_cost = 0
+
+    def trim_undo_history(self):
+        """Clear the undo history if its estimated size is over undo_budget, if that is set.
+
+        QTextDocument cannot drop only its oldest undo commands, so the whole history goes, undo
+        and redo alike. This is off unless undo_budget is set.
+        """
+        if self.undo_budget is None or self.undo_cost <= self.undo_budget:
+            return
+        self.document().clearUndoRedoStacks(QTextDocument.UndoAndRedoStacks)
+        self.reset_undo_tracking()
+
+    @contextmanager
+    def transaction(self):
+        """Make the edits done with the yielded cursor, and the tags they complete, one undo step."""
+        cursor = QTextCursor(self.document())
+        with self.batch_recognition(), self.edit_block(cursor, join=False):
+            yield cursor
+
+    @contextmanager
+    def edit_block(self, cursor: QTextCursor, join: bool):
+        """Edit within a new edit block of cursor, or within the previous one if join is set.
+
+        Tag conversion only joins the undo step of the last change if it was made in such a block.
+        """
+        if join:
+            cursor.joinPreviousEditBlock()
+        else:
+            cursor.beginEditBlock()
+        in_edit_block = self.in_edit_block
+        self.in_edit_block = True
+        try:
+            yield
+        finally:
+            try:
+                cursor.endEditBlock()
+            finally:
+                self.in_edit_block = in_edit_block
+
+    @contextmanager
+    def batch_recognition(self):
+        """Defer textChanged until the outermost batch ends, so that tag recognition runs once."""
+        if not self.batching:
+            blocked = self.blockSignals(True)
+        self.batching += 1
+        try:
+            yield
+        finally:
+            self.batching -= 1
+            if not self.batching:
+                self.blockSignals(blocked)
+                if self.dirty_range is not None:
+                    self.textChanged.emit()
 
     # def mouseDoubleClickEvent(self, e: QtGui.QMouseEvent) -> None:
     #     blocked = self.blockSignals(True)
@@ -48,20 +237,78 @@ class TagTextEdit(QTextEdit):
     #     cursor.select(QTextCursor.LineUnderCursor)
     #     self.setTextCursor(cursor)
 
-    def contextMenuEvent(self, e: QtGui.QContextMenuEvent) -> None:
-        menu = self.createStandardContextMenu()
-        for a in menu.actions():
-            if a.objectName() in ('edit-undo', 'edit-redo'):
-                menu.removeAction(a)
-        menu.exec_(e.globalPos())
+    def keyPressEvent(self, e: QtGui.QKeyEvent) -> None:
+        typing = (not e.modifiers() & (Qt.ControlModifier | Qt.AltModifier | Qt.MetaModifier)
+                  and (e.text().isprintable() and e.text() or e.key() in (Qt.Key_Backspace, Qt.Key_Delete)))
+        if not typing or self.isReadOnly():
+            super().keyPressEvent(e)
+            return
+        # typing runs in an edit block, so that the tag conversion it triggers can join its undo step;
+        # a run of typing at one place continues the block, like QTextDocument merges typed characters
+        cursor = self.textCursor()
+        doc = self.document()
+        join = not cursor.hasSelection() and self.typing_end == (cursor.position(), doc.availableUndoSteps())
+        undo_steps = doc.availableUndoSteps()
+        with self.edit_block(cursor, join):
+            super().keyPressEvent(e)
+        self.typing_end = None
+        if doc.availableUndoSteps() >= undo_steps and not self.textCursor().hasSelection():
+            self.typing_end = (self.textCursor().position(), doc.availableUndoSteps())
+
+    def paintEvent(self, e: QtGui.QPaintEvent) -> None:
+        monitor = latency.monitor
+        if monitor is None:
+            super().paintEvent(e)
+            return
+        monitor.call(latency.PAINT, super().paintEvent, e)
+        monitor.finish_event()
 
     def canInsertFromMimeData(self, source: QtCore.QMimeData) -> bool:
         return source.hasText()
 
     def insertFromMimeData(self, source: QtCore.QMimeData) -> None:
         if source.hasText():
-            text = source.text().replace(chr(0xa), chr(LINE_SEPARATOR))
-            super().insertPlainText(text)
+            self.paste_text(source.text())
+
+    def paste_text(self, text: str) -> 'ChunkedPaste':
+        """Paste the model string text at the cursor, see ChunkedPaste.
+
+        Returns None if a paste or copy is still running.
+        """
+        if self.clipboard_job is not None:
+            return None
+        job = ChunkedPaste(self, self.textCursor(), text, self)
+        self.run_clipboard_job(job)
+        return job
+
+    def copy_in_chunks(self, cut=False) -> 'ChunkedCopy':
+        """Copy or cut a selection longer than ChunkedCopy.chunk_size with a ChunkedCopy.
+
+        Returns None if the selection is short enough to be copied at once, or if a paste or copy
+        is still running.
+        """
+        cursor = self.textCursor()
+        if self.clipboard_job is not None:
+            return None
+        if cursor.selectionEnd() - cursor.selectionStart() <= ChunkedCopy.chunk_size:
+            return None
+        job = ChunkedCopy(self, cursor, cut and not self.isReadOnly(), self)
+        self.run_clipboard_job(job)
+        return job
+
+    def run_clipboard_job(self, job):
+        self.clipboard_job = job
+        job.finished.connect(self.on_clipboard_job_finished)
+        job.start()
+
+    def complete_clipboard_job(self):
+        """Finish a running paste or copy at once, before the document is read or committed."""
+        if self.clipboard_job is not None:
+            self.clipboard_job.complete()
+
+    def on_clipboard_job_finished(self):
+        self.clipboard_job.deleteLater()
+        self.clipboard_job = None
 
     # Called when a drag and drop operation is started, or when data is copied to the clipboard.
     def createMimeDataFromSelection(self) -> QtCore.QMimeData:
@@ -75,36 +322,291 @@ class TagTextEdit(QTextEdit):
         mime.setText(selected_text)
         return mime
 
+    def iter_model_data_in_range(self, start: int, end: int, chunk_size: int = 4096):
+        """Yield the model string of the range in pieces covering about chunk_size positions each.
+
+        The pieces are split between characters, never inside a surrogate pair or a tag,
+        so that joining them gives to_model_data_in_range(start, end).
+        """
+        doc = self.document()
+        while start < end:
+            stop = min(end, start + chunk_size)
+            if stop < end and 0xd800 <= ord(doc.characterAt(stop - 1)) < 0xdc00:
+                stop += 1
+            yield self.to_model_data_in_range(start, stop)
+            start = stop
+
     def to_model_data_in_range(self, start: int, end: int) -> str:
         doc = self.document()
         substrings = []
-        for pos in range(start, end):
-            char = doc.characterAt(pos)
-            if ord(char) == OBJECT_REPLACEMENT_CHARACTER:
-                current_block = doc.findBlock(pos)
-
-                # iterate text fragments within the block
-                it = current_block.begin()
-                while not it.atEnd():
-                    current_fragment = it.fragment()
-                    # check if the current position is located within the fragment
-                    if current_fragment.contains(pos):
-                        char_format = current_fragment.charFormat()
-                        # tag_name = char_format.property(TagTextObject.name_propid)
-                        substrings.append(TagTextObject.stringify(char_format))
-                        break
-                    it += 1
-            elif ord(char) in (LINE_SEPARATOR, PARAGRAPH_SEPARATOR):
+        block = doc.findBlock(start)
+        while block.isValid() and block.position() < end:
+            block_pos = block.position()
+            # iterate text fragments within the block, clipping the first and last one to the range
+            it = block.begin()
+            while not it.atEnd():
+                fragment = it.fragment()
+                it += 1
+                frag_start = fragment.position()
+                frag_end = frag_start + fragment.length()
+                if frag_end <= start:
+                    continue
+                if frag_start >= end:
+                    break
+                text = fragment.text()
+                if frag_start < start or frag_end > end:
+                    text = _utf16_slice(text, max(start, frag_start) - frag_start, min(end, frag_end) - frag_start,
+                                        fragment.length())
+                if chr(OBJECT_REPLACEMENT_CHARACTER) in text:
+                    text = text.replace(chr(OBJECT_REPLACEMENT_CHARACTER),
+                                        TagTextObject.stringify(fragment.charFormat()))
+                if chr(LINE_SEPARATOR) in text:
+                    text = text.replace(chr(LINE_SEPARATOR), '\n')
+                substrings.append(text)
+            # the block separator is not part of any fragment
+            separator_pos = block_pos + block.length() - 1
+            if start <= separator_pos < end:
                 substrings.append('\n')
-            else:
-                substrings.append(char)
-            # print(pos, len(char), char, hex(ord(char)))
+            block = block.next()
         text = ''.join(substrings)
         return text
 
+    def from_model_data(self, data: str) -> None:
+        """Replace the document with the segment encoded in data, the inverse of to_model_data().
+
+        The document is built in a single edit block with undo and textChanged suppressed,
+        so that tags are not recognized again and no undo history is recorded.
+        """
+        with self.replacing_document():
+            fill_document(self.document(), data, self.line_break)
+
+    @contextmanager
+    def replacing_document(self):
+        """Replace the document's content within the block, without undo history or tag recognition.
+
+        A paste or copy still running on the old content is aborted.
+        """
+        if self.clipboard_job is not None:
+            self.clipboard_job.abort()
+        doc = self.document()
+        blocked = self.blockSignals(True)
+        undo_enabled = doc.isUndoRedoEnabled()
+        doc.setUndoRedoEnabled(False)
+        try:
+            if self.lazy_layout:
+                with self.suspended_layout():
+                    yield
+            else:
+                yield
+        finally:
+            doc.setUndoRedoEnabled(undo_enabled)
+            self.reset_undo_tracking()
+            self.block_tag_cache.clear()
+            self.take_dirty_range()
+            self.blockSignals(blocked)
+
+    def set_lazy_layout(self, enabled: bool) -> None:
+        """Lay out the document lazily from now on, for segments too long to lay out at once.
+
+        The line breaks of loaded and pasted segments become blocks, which are what the layout
+        is done in, and documents are loaded with suspended_layout(). The vertical scroll bar
+        is always shown, so that its appearance does not make the layout start over.
+
+        Only segments with line breaks benefit: a block is always laid out as a whole, so a long
+        segment without line breaks is still laid out at once. The serializers turn blocks back
+        into '\n', so the model strings are the same either way.
+        """
+        self.lazy_layout = enabled
+        self.line_break = chr(PARAGRAPH_SEPARATOR) if enabled else chr(LINE_SEPARATOR)
+        self.setVerticalScrollBarPolicy(Qt.ScrollBarAlwaysOn if enabled else Qt.ScrollBarAsNeeded)
+
+    @contextmanager
+    def suspended_layout(self):
+        """Change the document within the block without laying it out, then have it laid out lazily.
+
+        A null page size makes the document layout ignore changes. Setting the page size back
+        lays the document out from the start the way QTextDocumentLayout does a full layout:
+        up to the viewport at once, the rest in growing steps from the event loop, or sooner
+        where it is painted. Meanwhile the height of the part not laid out yet is estimated
+        from its length, and refined as the layout proceeds. The cursor is moved to the start,
+        as keeping it visible at the end would lay out everything.
+
+        That QTextDocumentLayout skips changes while the page size is null is how Qt 5 behaves,
+        not documented API. Where it does not, the document is laid out as it is built, which is
+        only slower.
+        """
+        doc = self.document()
+        page_size = doc.pageSize()
+        doc.setPageSize(QSizeF(0, 0))
+        try:
+            yield
+        finally:
+            self.setTextCursor(QTextCursor(doc))
+            doc.setPageSize(page_size)
+
+    @classmethod
+    def tag_format(cls, name: str, kind: TagKind, content: str = None) -> QTextCharFormat:
+        # tags share one interned format per name, kind and tooltip
+        if content is None:
+            content = name
+        key = (name, kind, content)
+        char_format = cls.tag_formats.get(key)
+        if char_format is None:
+            char_format = TagTextObject.create_format(name, content, kind)
+            cls.tag_formats[key] = char_format
+        return char_format
+
+    def to_segment(self) -> Segment:
+        """Return the document as a Segment, keeping the tooltips of the tags."""
+        doc = self.document()
+        parts = []
+        tags = []
+        length = 0
+        block = doc.begin()
+        while block.isValid():
+            if block != doc.begin():
+                parts.append('\n')
+                length += 1
+            for fragment, tag in _block_fragments(block):
+                if tag is not None:
+                    tooltip = fragment.charFormat().toolTip()
+                    tags.extend((length, *tag, tooltip) for _ in range(fragment.length()))
+                    continue
+                text = fragment.text()
+                if chr(LINE_SEPARATOR) in text:
+                    text = text.replace(chr(LINE_SEPARATOR), '\n')
+                parts.append(text)
+                length += len(text)
+            block = block.next()
+        return Segment(''.join(parts), tags)
+
+    def from_segment(self, segment: Segment) -> None:
+        """Replace the document with segment, the inverse of to_segment()."""
+        with self.replacing_document():
+            doc = self.document()
+            doc.clear()
+            cursor = QTextCursor(doc)
+            cursor.beginEditBlock()
+            text_format = QTextCharFormat()
+            text = segment.text
+            pos = 0
+            for offset, name, kind, tooltip in segment.tags():
+                if offset > pos:
+                    cursor.insertText(text[pos:offset].replace('\n', self.line_break), text_format)
+                    pos = offset
+                cursor.insertText(chr(OBJECT_REPLACEMENT_CHARACTER), self.tag_format(name, kind, tooltip))
+            if pos < len(text):
+                cursor.insertText(text[pos:].replace('\n', self.line_break), text_format)
+            cursor.endEditBlock()
+
+    def insert_tag(self, cursor, name, content, kind):
+        # identical tags share one format, so the document's format collection does not grow with every tag
+        cursor.insertText(chr(OBJECT_REPLACEMENT_CHARACTER), self.tag_format(name, kind, content))
+
+    def set_extra_selections(self, group: str, selections: list) -> None:
+        """Replace the extra selections of group, keeping those of the other groups."""
+        if selections:
+            self.extra_selection_groups[group] = selections
+        else:
+            self.extra_selection_groups.pop(group, None)
+        self.setExtraSelections([selection for selections in self.extra_selection_groups.values()
+                                 for selection in selections])
+
+    def block_tags(self, block) -> list:
+        """Return the (offset in block, name, kind) of each tag in block.
+
+        The tags are cached per block number until invalidate_block_tags() drops them for a change,
+        so only the blocks changed since the last call are walked again.
+        """
+        number = block.blockNumber()
+        tags = self.block_tag_cache.get(number)
+        if tags is not None:
+            return tags
+        tags = []
+        block_pos = block.position()
+        for fragment, tag in _block_fragments(block):
+            if tag is not None:
+                offset = fragment.position() - block_pos
+                tags.extend((offset + i, *tag) for i in range(fragment.length()))
+        self.block_tag_cache[number] = tags
+        return tags
+
+    def tags(self) -> list:
+        """Return the (position, name, kind) of each tag in the document, see block_tags()."""
+        doc = self.document()
+        tags = []
+        block = doc.begin()
+        while block.isValid():
+            block_pos = block.position()
+            tags.extend((block_pos + offset, name, kind) for offset, name, kind in self.block_tags(block))
+            block = block.next()
+        return tags
+
+    def recognize_tags(self):
+        """Convert the tags typed or pasted since the last call into tag objects."""
+        monitor = latency.monitor
+        if monitor is None:
+            return self._recognize_tags()
+        return monitor.call(latency.RECOGNITION, self._recognize_tags)
+
+    def _recognize_tags(self):
+        # an undo brings back the text of converted tags, which must not be converted again
+        undone = self.undone
+        dirty_range = self.take_dirty_range()
+        if dirty_range is not None and not undone:
+            # only rescan the edited range, widened for tags crossing the edit boundary
+            self.convert_tags(*self.tag_scan_range(*dirty_range))
+        self.trim_undo_history()
+
+    def tag_scan_range(self, start: int, end: int) -> tuple:
+        """Return the range to rescan for tags after the text between start and end was edited.
+
+        The range is widened over the tag name characters on both sides, as a name can be longer
+        than any fixed margin, and then by TAG_SCAN_MARGIN for the rest of the tags.
+        """
+        doc = self.document()
+        is_name = _TAG_NAME_CHARACTER.match
+        while start > 0 and is_name(doc.characterAt(start - 1)):
+            start -= 1
+        last = doc.characterCount() - 1
+        while end < last and is_name(doc.characterAt(end)):
+            end += 1
+        return start - TAG_SCAN_MARGIN, end + TAG_SCAN_MARGIN
+
+    def convert_tags(self, start: int, end: int) -> None:
+        """Convert the tags written as text between start and end into tag objects.
+
+        The conversion joins the undo step of the edit that completed the tags if that edit was
+        made in an edit block of keyPressEvent() or transaction(), so that one undo reverts both.
+        After any other change, such as an IME commit, a drop or a programmatic edit, it is an
+        undo step of its own, so that it cannot join an unrelated earlier step.
+        """
+        doc = self.document()
+        start = max(0, start)
+        end = min(doc.characterCount() - 1, end)
+        cursor = QTextCursor(doc)
+        cursor.setPosition(start)
+        cursor.setPosition(end, QTextCursor.KeepAnchor)
+        text = cursor.selectedText()
+        matches = list(default_grammar.scan(text))
+        if not matches:
+            return
+        blocked = self.blockSignals(True)
+        with self.edit_block(cursor, join=self.joinable_edit):
+            # convert from the end so that earlier match positions stay valid
+            for (match_start, match_end), tag_kind, tag_name in reversed(matches):
+                if len(text) != end - start:
+                    match_start, match_end = _utf16_offset(text, match_start), _utf16_offset(text, match_end)
+                cursor.setPosition(start + match_start)
+                cursor.setPosition(start + match_end, QTextCursor.KeepAnchor)
+                self.insert_tag(cursor, tag_name, tag_name, tag_kind)
+        # discard the changes made by the conversion itself
+        self.take_dirty_range()
+        self.blockSignals(blocked)
+
     def to_model_data(self) -> str:
         start_pos = 0
-        end_pos = len(self.document().toPlainText())
+        end_pos = self.document().characterCount() - 1
         text = self.to_model_data_in_range(start_pos, end_pos)
         return text
 
@@ -144,39 +646,518 @@ class TagTextEdit(QTextEdit):
     #         cursor.removeSelectedText()
 
 
+class _QObjectABCMeta(type(QObject), abc.ABCMeta):
+    pass
+
+
+class ChunkedJob(QObject, metaclass=_QObjectABCMeta):
+    """A clipboard operation on a TagTextEdit that runs in steps, letting the event loop run in between.
+
+    A job that fits in one step runs at once. Otherwise the editor ignores input until the job is
+    finished, so that the document does not change under it; KeyEventFilter drops the key presses
+    that the other event filters, such as BoundaryHandler, would edit with. progress reports the
+    positions or characters done out of the total after each step. complete() does the remaining
+    steps at once and abort() drops them, for when the editor is about to be committed or reused.
+    """
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal()
+    chunk_size = 4096
+
+    def __init__(self, editor, total, parent=None):
+        super().__init__(parent)
+        self.editor = editor
+        self.total = total
+        self.done = 0
+        self.interaction_flags = None
+        self.running = False
+
+    def start(self):
+        if self.total <= self.chunk_size:
+            while self.step():
+                pass
+            self.finish()
+            return
+        self.interaction_flags = self.editor.textInteractionFlags()
+        self.editor.setTextInteractionFlags(Qt.NoTextInteraction)
+        self.running = True
+        QTimer.singleShot(0, self.run_step)
+
+    def run_step(self):
+        if not self.running:
+            return
+        if self.step():
+            self.progress.emit(self.done, self.total)
+            QTimer.singleShot(0, self.run_step)
+            return
+        self.stop()
+        self.finish()
+
+    def stop(self):
+        self.running = False
+        self.editor.setTextInteractionFlags(self.interaction_flags)
+
+    def complete(self):
+        """Do the remaining steps of a running job at once and finish it."""
+        if not self.running:
+            return
+        while self.step():
+            pass
+        self.stop()
+        self.finish()
+
+    def abort(self):
+        """Drop the remaining steps of a running job; finished is emitted all the same."""
+        if not self.running:
+            return
+        self.stop()
+        self.finished.emit()
+
+    @abc.abstractmethod
+    def step(self) -> bool:
+        """Do the next part of the job; return False when there is nothing left to do."""
+
+    def finish(self):
+        self.done = self.total
+        self.progress.emit(self.done, self.total)
+        self.finished.emit()
+
+
+class ChunkedPaste(ChunkedJob):
+    """Pastes a model string in slices of about chunk_size characters.
+
+    The tags in the string are found in one scan and inserted as tag objects along with the text,
+    so no slice is scanned again. The edit block of the paste stays open from the first slice to the
+    last, so that the paste is undone as one operation and the block holding it is laid out once,
+    instead of once per slice. Tags that the pasted text completes with the text around it are
+    converted with the last slice.
+    """
+    chunk_size = 16384
+
+    def __init__(self, editor, cursor, text, parent=None):
+        super().__init__(editor, len(text), parent)
+        self.cursor = QTextCursor(cursor)
+        self.start_pos = self.cursor.selectionStart()
+        self.slices = self.split(text)
+        self.slice = next(self.slices)
+        self.first = True
+        self.cursor.beginEditBlock()
+        self.block_open = True
+
+    def split(self, text):
+        """Yield the text runs and (name, kind) tags of text in slices, with the characters done after each."""
+        chunk_size = self.chunk_size
+        pieces = []
+        size = 0
+        pos = 0
+        end_of_text = ((len(text), len(text)), None, None)
+        for (start, end), kind, name in itertools.chain(default_grammar.scan(text), (end_of_text,)):
+            while pos < start:
+                run_end = min(start, pos + chunk_size - size)
+                pieces.append(text[pos:run_end])
+                size += run_end - pos
+                pos = run_end
+                if size >= chunk_size:
+                    yield pieces, pos
+                    pieces = []
+                    size = 0
+            if kind is None:
+                break
+            pieces.append((name, kind))
+            size += end - start
+            pos = end
+            if size >= chunk_size:
+                yield pieces, pos
+                pieces = []
+                size = 0
+        yield pieces, pos
+
+    def step(self) -> bool:
+        if self.slice is None:
+            return False
+        pieces, self.done = self.slice
+        self.slice = next(self.slices, None)
+        editor = self.editor
+        cursor = self.cursor
+        blocked = editor.blockSignals(True)
+        if self.first:
+            cursor.removeSelectedText()
+            self.first = False
+        text_format = QTextCharFormat()
+        for piece in pieces:
+            if isinstance(piece, str):
+                cursor.insertText(piece.replace('\n', editor.line_break), text_format)
+            else:
+                name, kind = piece
+                editor.insert_tag(cursor, name, name, kind)
+        if self.slice is None:
+            # only the seams with the surrounding text can hold tags that are still text
+            end_pos = cursor.position()
+            editor.convert_tags(*editor.tag_scan_range(end_pos, end_pos))
+            editor.convert_tags(*editor.tag_scan_range(self.start_pos, self.start_pos))
+            cursor.endEditBlock()
+            self.block_open = False
+            editor.take_dirty_range()
+        editor.blockSignals(blocked)
+        return True
+
+    def abort(self):
+        if self.running and self.block_open:
+            # the slices pasted so far stay, but the document is about to be replaced anyway
+            self.cursor.endEditBlock()
+            self.block_open = False
+            self.editor.take_dirty_range()
+        super().abort()
+
+    def finish(self):
+        self.editor.setTextCursor(self.cursor)
+        super().finish()
+        # the slices were inserted with the editor's signals blocked
+        self.editor.textChanged.emit()
+
+
+class ChunkedCopy(ChunkedJob):
+    """Copies or cuts the selection of cursor, serializing it with iter_model_data_in_range().
+
+    The clipboard is set when the whole selection has been serialized. A cut removes the selection
+    afterwards.
+    """
+
+    def __init__(self, editor, cursor, cut=False, parent=None):
+        super().__init__(editor, cursor.selectionEnd() - cursor.selectionStart(), parent)
+        self.cursor = QTextCursor(cursor)
+        self.cut = cut
+        self.pieces = editor.iter_model_data_in_range(cursor.selectionStart(), cursor.selectionEnd(),
+                                                      self.chunk_size)
+        self.substrings = []
+
+    def step(self) -> bool:
+        piece = next(self.pieces, None)
+        if piece is None:
+            return False
+        self.substrings.append(piece)
+        self.done = min(self.total, self.done + self.chunk_size)
+        return True
+
+    def finish(self):
+        mime = QMimeData()
+        mime.setText(''.join(self.substrings))
+        self.substrings = []
+        QApplication.clipboard().setMimeData(mime)
+        if self.cut:
+            self.cursor.removeSelectedText()
+            self.editor.setTextCursor(self.cursor)
+        super().finish()
+
+
+# tagdiff, qachecks, concurrent.futures and threading are only needed once a segment is edited, so the
+# live checks import them where they first use them, not at startup
+class LiveTagDiff(QObject):
+    """Keeps the tagdiff.TagDiff of a TagTextEdit against the tags of its source up to date.
+
+    The diff is computed again when control returns to the event loop after an edit, so that the
+    tags typed with the edit have been recognized, from TagTextEdit.tags(), which only walks the
+    blocks changed since the last diff. changed is emitted with the TagDiff and the document
+    position of each target tag, so that issues can be shown at their tags without scanning the
+    document. With underline set, the tags with issues are underlined through the editor's extra
+    selections.
+    """
+    changed = pyqtSignal(object, list)
+    # keyed by tagdiff.EXTRA, MOVED and NESTING
+    underline_colors = {
+        'extra': QColor(220, 0, 0),
+        'moved': QColor(0, 90, 220),
+        'nesting': QColor(150, 0, 200),
+    }
+
+    def __init__(self, editor, source: str, underline=True, parent=None):
+        from tagdiff import TagDiff, model_tags
+        super().__init__(parent)
+        self.editor = editor
+        self.source_tags = model_tags(source)
+        self.underline = underline
+        self.diff = TagDiff()
+        self.positions = []
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(0)
+        self.timer.timeout.connect(self.update)
+        editor.document().contentsChanged.connect(self.timer.start)
+        self.update()
+
+    def set_source(self, source: str) -> None:
+        from tagdiff import model_tags
+        self.source_tags = model_tags(source)
+        self.update()
+
+    def update(self) -> None:
+        from tagdiff import diff_tags
+        tags = self.editor.tags()
+        self.positions = [position for position, name, kind in tags]
+        self.diff = diff_tags(self.source_tags, [(name, kind) for position, name, kind in tags])
+        if self.underline:
+            self.editor.set_extra_selections('tags', self.extra_selections())
+        self.changed.emit(self.diff, self.positions)
+
+    def extra_selections(self) -> list:
+        doc = self.editor.document()
+        selections = []
+        for index, code in self.diff.target_issues().items():
+            selection = QTextEdit.ExtraSelection()
+            selection.cursor = QTextCursor(doc)
+            selection.cursor.setPosition(self.positions[index])
+            selection.cursor.setPosition(self.positions[index] + 1, QTextCursor.KeepAnchor)
+            selection.format = QTextCharFormat()
+            selection.format.setUnderlineStyle(QTextCharFormat.WaveUnderline)
+            selection.format.setUnderlineColor(self.underline_colors[code])
+            selections.append(selection)
+        return selections
+
+    def close(self) -> None:
+        self.timer.stop()
+        self.editor.document().contentsChanged.disconnect(self.timer.start)
+        if self.underline:
+            self.editor.set_extra_selections('tags', [])
+
+
+class LiveQA(QObject):
+    """Runs the qachecks checks of a TagTextEdit against its source on a worker thread as it is edited.
+
+    Once the document has not changed for delay milliseconds, its model string is taken with
+    to_model_data(), an immutable snapshot, and checked on a thread pool shared by all editors,
+    so that the checks never hold up typing. An edit cancels the job of the previous snapshot:
+    a job still queued is dropped, a running one stops before its next check, and the results
+    of a job that has been superseded are ignored. The worker hands its issues to the GUI thread
+    through finished, which has a queued connection. changed is then emitted with the issues,
+    their spans converted to document positions. With underline set, the spans are underlined
+    through the editor's extra selections.
+    """
+    changed = pyqtSignal(list)
+    finished = pyqtSignal(int, object)
+    delay = 150
+    workers = 2
+    executor = None
+    underline_color = QColor(230, 140, 0)
+
+    def __init__(self, editor, source: str, checks=None, underline=True, parent=None):
+        from qachecks import default_checks, plain_text
+        super().__init__(parent)
+        self.editor = editor
+        self.source = plain_text(source)
+        self.checks = checks or default_checks
+        self.underline = underline
+        self.issues = []
+        # bumped whenever the running job becomes stale
+        self.generation = 0
+        self.future = None
+        self.cancelled = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(self.delay)
+        self.timer.timeout.connect(self.submit)
+        self.finished.connect(self.deliver, Qt.QueuedConnection)
+        editor.document().contentsChanged.connect(self.schedule)
+        self.submit()
+
+    @classmethod
+    def pool(cls) -> 'concurrent.futures.Executor':
+        import concurrent.futures
+        if cls.executor is None:
+            cls.executor = concurrent.futures.ThreadPoolExecutor(max_workers=cls.workers, thread_name_prefix='qa')
+        return cls.executor
+
+    @staticmethod
+    def check(checks, source: str, data: str, cancelled: 'threading.Event'):
+        """Return the issues of the model string data with document positions, or None if cancelled.
+
+        Runs on a worker thread.
+        """
+        from qachecks import plain_text
+        target = plain_text(data)
+        issues = checks.run(source, target, cancelled)
+        if issues is None or len(target.encode('utf-16-le', 'surrogatepass')) == 2 * len(target):
+            return issues
+        return [issue if issue.start is None else
+                issue._replace(start=_utf16_offset(target, issue.start), end=_utf16_offset(target, issue.end))
+                for issue in issues]
+
+    def set_source(self, source: str) -> None:
+        from qachecks import plain_text
+        self.source = plain_text(source)
+        self.submit()
+
+    def schedule(self) -> None:
+        self.cancel()
+        self.timer.start()
+
+    def cancel(self) -> None:
+        self.generation += 1
+        if self.future is not None:
+            self.future.cancel()
+            self.cancelled.set()
+            self.future = None
+
+    def submit(self) -> None:
+        import threading
+        self.timer.stop()
+        self.cancel()
+        generation = self.generation
+        self.cancelled = threading.Event()
+        self.future = self.pool().submit(self.check, self.checks, self.source, self.editor.to_model_data(),
+                                         self.cancelled)
+        self.future.add_done_callback(lambda future: self.on_done(generation, future))
+
+    def on_done(self, generation: int, future: 'concurrent.futures.Future') -> None:
+        # called on the worker thread, or on the GUI thread for a cancelled job
+        if future.cancelled():
+            return
+        issues = future.result()
+        if issues is None:
+            return
+        try:
+            self.finished.emit(generation, issues)
+        except RuntimeError:
+            # deleted while the job ran
+            pass
+
+    def deliver(self, generation: int, issues: list) -> None:
+        if generation != self.generation:
+            return
+        self.future = None
+        self.issues = issues
+        if self.underline:
+            self.editor.set_extra_selections('qa', self.extra_selections())
+        self.changed.emit(issues)
+
+    def extra_selections(self) -> list:
+        doc = self.editor.document()
+        end = doc.characterCount() - 1
+        selections = []
+        for issue in self.issues:
+            if issue.start is None or issue.start >= end:
+                continue
+            selection = QTextEdit.ExtraSelection()
+            selection.cursor = QTextCursor(doc)
+            selection.cursor.setPosition(issue.start)
+            selection.cursor.setPosition(min(max(issue.end, issue.start + 1), end), QTextCursor.KeepAnchor)
+            selection.format = QTextCharFormat()
+            selection.format.setUnderlineStyle(QTextCharFormat.DotLine)
+            selection.format.setUnderlineColor(self.underline_color)
+            selections.append(selection)
+        return selections
+
+    def close(self) -> None:
+        self.timer.stop()
+        self.cancel()
+        self.editor.document().contentsChanged.disconnect(self.schedule)
+        if self.underline:
+            self.editor.set_extra_selections('qa', [])
+
+
 class TagTextObject(QObject, QTextObjectInterface):
     type = QTextFormat.UserObject + 1
-    id_propid = 10000
     name_propid = 10001
     kind_propid = 10002
 
+    @staticmethod
+    def create_format(name: str, content: str, kind: TagKind) -> QTextCharFormat:
+        char_format = QTextCharFormat()
+        char_format.setProperty(TagTextObject.name_propid, name)
+        char_format.setProperty(TagTextObject.kind_propid, kind)
+        char_format.setToolTip(content)
+        char_format.setObjectType(TagTextObject.type)
+        char_format.setVerticalAlignment(QTextCharFormat.AlignTop)
+        return char_format
+
     @staticmethod
     def stringify(char_format: 'QTextCharFormat') -> str:
         name: str = char_format.property(TagTextObject.name_propid)
         kind: TagKind = char_format.property(TagTextObject.kind_propid)
-        if kind == TagKind.START:
-            return f'{{{name}>'
-        if kind == TagKind.END:
-            return f'<{name}}}'
-        return f'{{{name}}}'
+        return default_grammar.stringify(name, kind)
+
+    # upper bounds for the number of cached tag sizes and rendered tag pixmaps
+    size_cache_limit = 4096
+    pixmap_cache_limit = 512
+    # room around a rendered tag for the outline pen, which is drawn centered on the tag's edge
+    pixmap_margin = 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.size_cache = OrderedDict()
+        self.pixmap_cache = OrderedDict()
+
+    def clear_cache(self):
+        self.size_cache.clear()
+        self.pixmap_cache.clear()
 
     def intrinsicSize(self, doc: 'QTextDocument', pos_in_document: int, format_: 'QTextFormat') -> QtCore.QSizeF:
+        monitor = latency.monitor
+        if monitor is None:
+            return self.tag_size(format_)
+        return monitor.call(latency.LAYOUT, self.tag_size, format_)
+
+    def tag_size(self, format_: 'QTextFormat') -> QtCore.QSizeF:
         charformat = format_.toCharFormat()
         font = charformat.font()
-        fm = QFontMetrics(font)
         tag_name = format_.property(TagTextObject.name_propid)
+        key = (font.key(), tag_name)
+        size = self.size_cache.get(key)
+        if size is not None:
+            self.size_cache.move_to_end(key)
+            return QtCore.QSizeF(size)
+        fm = QFontMetrics(font)
         sz = fm.boundingRect(tag_name).size()
         sz.setWidth(sz.width() + 12)
         sz.setHeight(sz.height() + 4)
-        return QtCore.QSizeF(sz)
+        size = QtCore.QSizeF(sz)
+        self.size_cache[key] = size
+        if len(self.size_cache) > self.size_cache_limit:
+            self.size_cache.popitem(last=False)
+        return QtCore.QSizeF(size)
 
     def drawObject(self, painter: 'QPainter', rect: QtCore.QRectF, doc: 'QTextDocument', pos_in_document: int,
                    format_: 'QTextFormat') -> None:
+        monitor = latency.monitor
+        if monitor is None:
+            self.draw_tag(painter, rect, format_)
+            return
+        monitor.call(latency.DRAW, self.draw_tag, painter, rect, format_)
+
+    def draw_tag(self, painter: 'QPainter', rect: QtCore.QRectF, format_: 'QTextFormat') -> None:
+        tag_kind: TagKind = format_.property(TagTextObject.kind_propid)
+        tag_name = format_.property(TagTextObject.name_propid)
+        font = painter.font()
+        device = painter.device()
+        ratio = device.devicePixelRatioF() if device is not None else 1.0
+        key = (font.key(), tag_name, tag_kind, ratio, rect.width(), rect.height())
+        pixmap = self.pixmap_cache.get(key)
+        if pixmap is None:
+            pixmap = self.render_tag(font, ratio, rect.size(), tag_kind, tag_name)
+            self.pixmap_cache[key] = pixmap
+            if len(self.pixmap_cache) > self.pixmap_cache_limit:
+                self.pixmap_cache.popitem(last=False)
+        else:
+            self.pixmap_cache.move_to_end(key)
+        margin = self.pixmap_margin
+        painter.drawPixmap(QtCore.QPointF(rect.left() - margin, rect.top() - margin), pixmap)
+
+    def render_tag(self, font, ratio: float, size: QtCore.QSizeF, tag_kind: TagKind, tag_name: str) -> QPixmap:
+        margin = self.pixmap_margin
+        pixmap = QPixmap(QtCore.QSize(round((size.width() + 2 * margin) * ratio),
+                                      round((size.height() + 2 * margin) * ratio)))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        painter.setFont(font)
+        self.paint_tag(painter, QRectF(QtCore.QPointF(margin, margin), size), tag_kind, tag_name)
+        painter.end()
+        return pixmap
+
+    @staticmethod
+    def paint_tag(painter: 'QPainter', rect: QtCore.QRectF, tag_kind: TagKind, tag_name: str) -> None:
         painter.setRenderHint(QPainter.Antialiasing, True)
         c = QColor(255, 80, 0, 160)
         painter.setBrush(QBrush(c, Qt.SolidPattern))
         painter.setPen(QPen(QtCore.Qt.white, 2, QtCore.Qt.SolidLine))
-        tag_kind: TagKind = format_.property(TagTextObject.kind_propid)
 
         top = rect.top()
         left = rect.left()
@@ -210,33 +1191,56 @@ class TagTextObject(QObject, QTextObjectInterface):
             painter.drawPath(path.simplified())
         else:
             painter.drawRoundedRect(rect, 4, 4)
-        tag_name = format_.property(TagTextObject.name_propid)
         painter.drawText(rect, QtCore.Qt.AlignHCenter | QtCore.Qt.AlignCenter, tag_name)
 
 
+class TimedBoundaryHandler(BoundaryHandler):
+    """A BoundaryHandler whose key handling is timed as a stage of the latency event of the key."""
+
+    def keyPressEvent(self, obj, ev):
+        monitor = latency.monitor
+        if monitor is None:
+            return super().keyPressEvent(obj, ev)
+        return monitor.call(latency.WORD_KEYS, super().keyPressEvent, obj, ev)
+
+
 class KeyEventFilter(QObject):
     def __init__(self):
         super().__init__()
         self.widget = None
 
     def install_to(self, widget):
+        """Install the filter on widget, after its other event filters.
+
+        Qt runs the filter installed last first, so that key presses begin their latency event here
+        before the other filters, such as BoundaryHandler, handle them.
+        """
         self.widget = widget
         self.widget.installEventFilter(self)
 
     def eventFilter(self, obj: 'QObject', event: 'QEvent') -> bool:
+        monitor = latency.monitor
+        if monitor is None or obj != self.widget or event.type() != QEvent.KeyPress:
+            return self.filter_key_event(obj, event)
+        monitor.begin_event()
+        return monitor.call(latency.KEY_FILTER, self.filter_key_event, obj, event)
+
+    def filter_key_event(self, obj: 'QObject', event: 'QEvent') -> bool:
         # print('eventFilter', event.type())
         if obj == self.widget and event.type() == QEvent.KeyPress:
+            if self.widget.clipboard_job is not None:
+                # a chunked paste keeps its edit block open, the document must not change meanwhile
+                return True
             modifiers = QApplication.keyboardModifiers()
             key = event.key()
             if modifiers != QtCore.Qt.ShiftModifier and key == Qt.Key_Return:
                 return True
             if modifiers != (QtCore.Qt.ShiftModifier | QtCore.Qt.KeypadModifier) and key == Qt.Key_Enter:
                 return True
-            if QKeySequence(modifiers | key).matches(QKeySequence.Undo):
-                # TODO: handle right-click undo
-                print('undo')
-                self.widget.is_undoing = True
-
+            if QKeySequence(modifiers | key).matches(QKeySequence.Copy) and self.widget.copy_in_chunks():
+                return True
+            if QKeySequence(modifiers | key).matches(QKeySequence.Cut) and self.widget.copy_in_chunks(cut=True):
+                return True
             # modifiers = QApplication.keyboardModifiers()
             # if modifiers == QtCore.Qt.ControlModifier and event.key() == Qt.Key_C:
             #     print('ctrl+c')
@@ -267,32 +1271,26 @@ class MouseEventFilter(QObject):
 
 
 class ExampleWindow(QWidget):
-    APPID = str(uuid.uuid4())
+    # created on first use, uuid is slow to import
+    APPID = None
 
-    def __init__(self):
+    def __init__(self, deferred=False):
+        """Build the window around the example segment.
+
+        With deferred set, the buttons and event filters are only created after the editor
+        has been painted for the first time, see setup_secondary().
+        """
         super().__init__()
+        if ExampleWindow.APPID is None:
+            import uuid
+            ExampleWindow.APPID = str(uuid.uuid4())
         self.setWindowTitle('Example window')
         self.tageditor = TagTextEdit()
         self.tageditor.APPID = self.APPID
         self.tageditor.setAlignment(QtCore.Qt.AlignVCenter)
 
-        self.zoomInButton = QPushButton()
-        self.zoomInButton.setText('↑')
-        self.zoomInButton.clicked.connect(self.zoom_in)
-
-        self.zoomOutButton = QPushButton()
-        self.zoomOutButton.setText('↓')
-        self.zoomOutButton.clicked.connect(self.zoom_out)
-
-        self.printModelButton = QPushButton()
-        self.printModelButton.setText('To Model')
-        self.printModelButton.clicked.connect(self.print_model)
-
         layout = QVBoxLayout()
         layout.addWidget(self.tageditor)
-        layout.addWidget(self.zoomInButton)
-        layout.addWidget(self.zoomOutButton)
-        layout.addWidget(self.printModelButton)
         self.setLayout(layout)
 
         self.register_tag_type()
@@ -317,21 +1315,49 @@ class ExampleWindow(QWidget):
         self.insert_tag(cursor, '4', 'image', TagKind.EMPTY)
         self.tageditor.setTextCursor(cursor)
 
-        self.key_event_filter = KeyEventFilter()
-        self.key_event_filter.install_to(self.tageditor)
-        # self.mouse_event_filter = MouseEventFilter()
-        # self.mouse_event_filter.install_to(self.tageditor.viewport())
-        self.mouse_event_filter = BoundaryHandler()
-        self.mouse_event_filter.install_textedit(self.tageditor)
-
         # self.tageditor.currentCharFormatChanged.connect(self.on_character_format_change)
         # self.tageditor.selectionChanged.connect(self._trigger_obj_char_rescan)
+        self.tageditor.take_dirty_range()
         self.tageditor.textChanged.connect(self.on_text_changed)
 
+        self.first_paint = latency.FirstPaintTimer(self.tageditor.viewport(), STARTED, self)
+        if deferred:
+            self.first_paint.painted.connect(self.setup_secondary)
+        else:
+            self.setup_secondary()
+
+    def setup_secondary(self):
+        """Create the widgets and event filters that are not needed to show the segment."""
+        self.zoomInButton = QPushButton()
+        self.zoomInButton.setText('↑')
+        self.zoomInButton.clicked.connect(self.zoom_in)
+
+        self.zoomOutButton = QPushButton()
+        self.zoomOutButton.setText('↓')
+        self.zoomOutButton.clicked.connect(self.zoom_out)
+
+        self.printModelButton = QPushButton()
+        self.printModelButton.setText('To Model')
+        self.printModelButton.clicked.connect(self.print_model)
+
+        layout = self.layout()
+        layout.addWidget(self.zoomInButton)
+        layout.addWidget(self.zoomOutButton)
+        layout.addWidget(self.printModelButton)
+
+        # self.mouse_event_filter = MouseEventFilter()
+        # self.mouse_event_filter.install_to(self.tageditor.viewport())
+        self.mouse_event_filter = TimedBoundaryHandler()
+        self.mouse_event_filter.install_textedit(self.tageditor)
+        self.key_event_filter = KeyEventFilter()
+        self.key_event_filter.install_to(self.tageditor)
+
     def zoom_in(self):
+        self.tag_object.clear_cache()
         self.tageditor.zoomIn(1)
 
     def zoom_out(self):
+        self.tag_object.clear_cache()
         self.tageditor.zoomOut(1)
 
     def print_model(self):
@@ -343,53 +1369,32 @@ class ExampleWindow(QWidget):
 
     def register_tag_type(self):
         document_layout = self.tageditor.document().documentLayout()
-        document_layout.registerHandler(TagTextObject.type, TagTextObject(self))
+        self.tag_object = TagTextObject(self)
+        document_layout.registerHandler(TagTextObject.type, self.tag_object)
 
     def insert_tag(self, cursor, name, content, kind):
-        char_format = QTextCharFormat()
-        char_format.setProperty(TagTextObject.name_propid, name)
-        char_format.setProperty(TagTextObject.id_propid, uuid.uuid4())
-        char_format.setProperty(TagTextObject.kind_propid, kind)
-        char_format.setToolTip(content)
-        char_format.setObjectType(TagTextObject.type)
-        char_format.setVerticalAlignment(QTextCharFormat.AlignTop)
-        cursor.insertText(chr(OBJECT_REPLACEMENT_CHARACTER), char_format)
+        self.tageditor.insert_tag(cursor, name, content, kind)
 
     def on_text_changed(self):
-        if self.tageditor.is_undoing:
-            self.tageditor.is_undoing = False
-            return
-        blocked = self.tageditor.blockSignals(True)
-        self.tageditor.textCursor().beginEditBlock()
-        doc = self.tageditor.document()
-        # pattern = QtCore.QRegExp(r'\{\d{1,2}\}|\{\d{1,2}>|<\d{1,2}\}')
-        pattern = QtCore.QRegExp(r'\{\d{1,2}\}|\{\d{1,2}>|<\d{1,2}\}|\{j\}|\{[biu_^]+>|<[biu_^]+\}')
-        pattern.setMinimal(True)
-        cursor = QTextCursor(doc)
-        # print('textChanged')
-        while True:
-            cursor = doc.find(pattern, cursor)
-            if cursor.isNull():
-                break
-            matched_str = cursor.selectedText()
-            if matched_str.endswith('>'):
-                tag_name = cursor.selectedText().strip('{>')
-                self.insert_tag(cursor, tag_name, tag_name, TagKind.START)
-            elif matched_str.startswith('<'):
-                tag_name = cursor.selectedText().strip('<}')
-                self.insert_tag(cursor, tag_name, tag_name, TagKind.END)
-            elif matched_str.startswith('{'):
-                tag_name = cursor.selectedText().strip('{}')
-                self.insert_tag(cursor, tag_name, tag_name, TagKind.EMPTY)
-
-        self.tageditor.textCursor().endEditBlock()
-        self.tageditor.blockSignals(blocked)
+        self.tageditor.recognize_tags()
 
 
 if __name__ == '__main__':
+    import os
     import sys
 
     app = QApplication(sys.argv)
-    window = ExampleWindow()
+    if os.environ.get('TAGEDITOR_LATENCY'):
+        latency.enable(interval_ms=5000, path=os.environ['TAGEDITOR_LATENCY'])
+    window = ExampleWindow(deferred=True)
+    if os.environ.get('TAGEDITOR_STARTUP'):
+        latency.report_startup(window.first_paint, os.environ['TAGEDITOR_STARTUP'])
+    if os.environ.get('TAGEDITOR_AUTOSAVE'):
+        from autosave import AutoSaver
+        autosaver = AutoSaver(os.environ['TAGEDITOR_AUTOSAVE'])
+        if 'example' in autosaver.recovered:
+            window.tageditor.from_model_data(autosaver.recovered['example'])
+        autosaver.watch(window.tageditor, 'example')
+        app.aboutToQuit.connect(autosaver.close)
     window.show()
     sys.exit(app.exec_())
@@ -0,0 +1,259 @@
+"""
+Per-segment QA checks beyond the tags: numbers, placeholders, whitespace,
+length and terminology.
+
+A check is a callable with a name that takes the plain text of the source and
+the target of a segment and returns a list of QAIssues for the target. In the
+plain text, made by plain_text() from a model string, each tag is a single
+object replacement character, so offsets into the target's plain text are the
+document positions of the editor, counted in code points. The checks to run
+are registered with a QAChecks, which runs the enabled ones in order and can
+be cancelled between checks. default_checks has the checks enabled that need
+no configuration; LengthCheck and TerminologyCheck are registered with their
+limits and glossary. This module does not depend on Qt.
+
+In the editor, main.LiveQA runs the checks of a TagTextEdit on a worker thread
+as the target is edited.
+
+"""
+
+
+import collections
+import re
+
+from tags import ICU, PRINTF, TagGrammar, default_grammar
+
+# the character a tag is replaced with in plain text, as in the editor's document
+TAG_CHARACTER = '\ufffc'
+
+MISSING = 'missing'
+EXTRA = 'extra'
+
+
+class QAIssue(collections.namedtuple('QAIssue', 'check code start end message')):
+    """A problem found by the check named check.
+
+    start and end are the span of the issue in the plain text of the target,
+    or None if the issue is about something the target lacks.
+
+    """
+    __slots__ = ()
+
+
+def plain_text(data):
+    """Return the model string data with each tag replaced by TAG_CHARACTER."""
+    return default_grammar.pattern.sub(TAG_CHARACTER, data)
+
+
+def _mismatches(check, source_items, target_items, describe):
+    """Return the issues of the items missing from or extra in the target.
+
+    The items are (key, start, end) tuples. Where the target has more items
+    with a key than the source, its last ones are extra.
+
+    """
+    remaining = collections.Counter(key for key, start, end in source_items)
+    issues = []
+    for key, start, end in target_items:
+        if remaining[key] > 0:
+            remaining[key] -= 1
+        else:
+            issues.append(QAIssue(check, EXTRA, start, end, f'{describe} {key} is not in the source'))
+    missing = [QAIssue(check, MISSING, None, None, f'{describe} {key} is missing')
+               for key, count in remaining.items() for _ in range(count)]
+    return missing + issues
+
+
+class NumberCheck:
+    """Reports numbers of the source missing from the target and numbers the source does not have.
+
+    Numbers are compared by their digits, so that decimal and thousands
+    separators may follow the conventions of the target language.
+
+    """
+    name = 'numbers'
+    pattern = re.compile(r'\d+(?:[,.\u00a0\u202f\u2009 ]\d{3})*(?:[,.]\d+)?')
+
+    def numbers(self, text):
+        return [(re.sub(r'\D', '', match.group()), match.start(), match.end())
+                for match in self.pattern.finditer(text)]
+
+    def __call__(self, source, target):
+        return _mismatches(self.name, self.numbers(source), self.numbers(target), 'number')
+
+
+class PlaceholderCheck:
+    """Reports printf and ICU placeholders that differ between source and target.
+
+    Placeholders recognized as tags are tag characters in the plain text, and
+    are left to the tag diff.
+
+    """
+    name = 'placeholders'
+
+    def __init__(self, syntaxes=(PRINTF, ICU)):
+        self.grammar = TagGrammar(syntaxes)
+
+    def placeholders(self, text):
+        return [(name, start, end) for (start, end), kind, name in self.grammar.scan(text)]
+
+    def __call__(self, source, target):
+        return _mismatches(self.name, self.placeholders(source), self.placeholders(target), 'placeholder')
+
+
+class WhitespaceCheck:
+    """Reports the whitespace the editor shows with ShowTabsAndSpaces that is probably a mistake.
+
+    These are runs of spaces within a line, tabs where the source has none,
+    and leading or trailing whitespace that differs from the source's.
+
+    """
+    name = 'whitespace'
+    double_space = re.compile(r'(?<=[^\s])[ \u00a0]{2,}(?=[^\s])')
+    leading = re.compile(r'\A[ \t\u00a0]*')
+    trailing = re.compile(r'[ \t\u00a0]*\Z')
+
+    def __call__(self, source, target):
+        issues = [QAIssue(self.name, 'double-space', match.start(), match.end(), 'more than one space')
+                  for match in self.double_space.finditer(target)]
+        if '\t' not in source:
+            issues.extend(QAIssue(self.name, 'tab', match.start(), match.end(), 'tab not in the source')
+                          for match in re.finditer('\t+', target))
+        for code, side, pattern in (('leading-space', 'leading', self.leading),
+                                    ('trailing-space', 'trailing', self.trailing)):
+            match = pattern.search(target)
+            if not target or match.group() == pattern.search(source).group():
+                continue
+            if match.start() == match.end():
+                issues.append(QAIssue(self.name, code, None, None, f'{side} whitespace of the source is missing'))
+            else:
+                issues.append(QAIssue(self.name, code, match.start(), match.end(),
+                                      f'{side} whitespace differs from the source'))
+        issues.sort(key=lambda issue: -1 if issue.start is None else issue.start)
+        return issues
+
+
+class LengthCheck:
+    """Reports targets longer than max_length characters or max_ratio times the source.
+
+    Tags are not counted. The issue spans the text beyond the limit.
+
+    """
+    name = 'length'
+
+    def __init__(self, max_length=None, max_ratio=None):
+        self.max_length = max_length
+        self.max_ratio = max_ratio
+
+    def limit(self, source):
+        limits = [self.max_length] if self.max_length is not None else []
+        if self.max_ratio is not None:
+            limits.append(int(len(source.replace(TAG_CHARACTER, '')) * self.max_ratio))
+        return min(limits) if limits else None
+
+    def __call__(self, source, target):
+        limit = self.limit(source)
+        length = len(target) - target.count(TAG_CHARACTER)
+        if limit is None or length <= limit:
+            return []
+        # the offset of the first character beyond the limit, skipping tags
+        counted = 0
+        for offset, char in enumerate(target):
+            if char != TAG_CHARACTER:
+                if counted == limit:
+                    break
+                counted += 1
+        return [QAIssue(self.name, 'too-long', offset, len(target),
+                        f'{length} characters, at most {limit} allowed')]
+
+
+class TerminologyCheck:
+    """Reports source terms of a glossary whose approved translations are all missing from the target.
+
+    glossary maps each source term to an iterable of approved translations.
+    Terms are matched as whole words, ignoring case, preferring longer terms.
+
+    """
+    name = 'terminology'
+
+    def __init__(self, glossary):
+        self.glossary = {term.casefold(): list(translations) for term, translations in glossary.items()}
+        terms = sorted(self.glossary, key=len, reverse=True)
+        self.pattern = re.compile(r'(?<!\w)(?:%s)(?!\w)' % '|'.join(map(re.escape, terms)) if terms else r'(?!)',
+                                  re.IGNORECASE)
+
+    def __call__(self, source, target):
+        folded = target.casefold()
+        issues = []
+        reported = set()
+        for match in self.pattern.finditer(source):
+            term = match.group().casefold()
+            if term in reported:
+                continue
+            translations = self.glossary.get(term)
+            if translations is None:
+                continue
+            if not any(translation.casefold() in folded for translation in translations):
+                reported.add(term)
+                issues.append(QAIssue(self.name, MISSING, None, None,
+                                      f'{match.group()} is not translated as {" or ".join(translations)}'))
+        return issues
+
+
+class QAChecks:
+    """A registry of checks, run in the order they were enabled."""
+
+    def __init__(self, checks=(), enabled=None):
+        self.checks = {}
+        self.enabled = []
+        for check in checks:
+            self.register(check, enabled is None or check.name in enabled)
+
+    def register(self, check, enabled=True):
+        """Add check, replacing a check of the same name."""
+        self.checks[check.name] = check
+        if enabled and check.name not in self.enabled:
+            self.enabled.append(check.name)
+
+    def enable(self, name):
+        if name not in self.checks:
+            raise KeyError(name)
+        if name not in self.enabled:
+            self.enabled.append(name)
+
+    def disable(self, name):
+        if name in self.enabled:
+            self.enabled.remove(name)
+
+    def set_enabled(self, names):
+        """Enable exactly the named checks, in the given order."""
+        for name in names:
+            if name not in self.checks:
+                raise KeyError(name)
+        self.enabled = list(names)
+
+    def run(self, source, target, cancelled=None):
+        """Return the issues of the plain texts source and target, or None if cancelled was set.
+
+        cancelled is a threading.Event, looked at before each check, so that a
+        check run on another thread can be cancelled. The enabled checks are
+        looked up once, so the registry may be changed meanwhile.
+
+        """
+        checks = [self.checks[name] for name in self.enabled]
+        issues = []
+        for check in checks:
+            if cancelled is not None and cancelled.is_set():
+                return None
+            issues.extend(check(source, target))
+        return issues
+
+
+default_checks = QAChecks((NumberCheck(), PlaceholderCheck(), WhitespaceCheck()))
+
+
+def check_segment(source, target, checks=None):
+    """Return the QAIssues of the model strings source and target; a target of None has no issues."""
+    if target is None:
+        return []
+    return (checks or default_checks).run(plain_text(source), plain_text(target))
@@ -0,0 +1,244 @@
+"""
+Search and replace across all the segments of a file.
+
+A SearchIndex works on a list of segments, objects with source and target
+attributes holding model strings such as the XliffSegments of
+xliff.read_xliff(). It searches the model strings, so it can tell tags from
+text, in one of three modes:
+
+LITERAL matches the query as is. A query can contain tags in their model
+form, and never matches part of a tag.
+
+REGEX matches a regular expression, with the same restriction. ^ and $ match
+at the start and end of each segment and at line breaks within it.
+
+IGNORE_TAGS matches the query against the text of the segments without their
+tags, so 'open file' also matches 'open {1>file<1}'. The tags within a match
+are kept when it is replaced.
+
+The text of each segment side is kept per mode and searched on its own, so a
+match never runs from one segment into the next; rows without a match are
+passed over with a single search. update() refreshes only the row it is
+given, and the tags of each segment are cached until update() is called for
+its row. Replacements are made on the model strings, so no document is
+needed for them, and a replacement that would leave a segment with
+unbalanced or crossing tag pairs is refused.
+
+"""
+
+
+import array
+import bisect
+import re
+
+from tags import default_grammar
+
+LITERAL = 'literal'
+REGEX = 'regex'
+IGNORE_TAGS = 'ignore-tags'
+
+SIDES = ('source', 'target')
+
+
+def strip_tags(data):
+    """Return the model string data without its tags."""
+    return default_grammar.pattern.sub('', data)
+
+
+class TagPairingError(ValueError):
+    """Raised when a replacement would break the tag pairs of a segment."""
+
+
+class SearchHit:
+    """A match in the model string of a segment.
+
+    start and end are offsets in the model string of the given row and side.
+    match is the match object the hit was found with.
+
+    """
+    __slots__ = ('row', 'side', 'start', 'end', 'match')
+
+    def __init__(self, row, side, start, end, match):
+        self.row = row
+        self.side = side
+        self.start = start
+        self.end = end
+        self.match = match
+
+    def __repr__(self):
+        return f'SearchHit({self.row}, {self.side!r}, {self.start}, {self.end})'
+
+
+class _Entry:
+    """The cached tags of one side of a segment."""
+    __slots__ = ('data', 'tag_starts', 'tag_ends', 'tag_offsets', 'tag_shift')
+
+    def __init__(self, data):
+        self.data = data
+        self.tag_starts = array.array('i')
+        self.tag_ends = array.array('i')
+        self.tag_offsets = array.array('i')
+        # tag_shift[i] is the length of the first i tags in the model string
+        self.tag_shift = array.array('i', [0])
+        for (start, end), kind, name in default_grammar.scan(data):
+            self.tag_starts.append(start)
+            self.tag_ends.append(end)
+            self.tag_offsets.append(start - self.tag_shift[-1])
+            self.tag_shift.append(self.tag_shift[-1] + end - start)
+
+    def has_tags(self, start, end):
+        """Return True if a tag starts within start, end."""
+        i = bisect.bisect_left(self.tag_starts, start)
+        return i < len(self.tag_starts) and self.tag_starts[i] < end
+
+    def inside_tag(self, pos):
+        """Return True if pos is within, not at the edge of, a tag."""
+        i = bisect.bisect_right(self.tag_starts, pos) - 1
+        return i >= 0 and self.tag_starts[i] < pos < self.tag_ends[i]
+
+    def model_span(self, start, end):
+        """Return the model string span of the text span start, end, without the tags around it."""
+        first = bisect.bisect_right(self.tag_offsets, start)
+        last = bisect.bisect_left(self.tag_offsets, end)
+        return start + self.tag_shift[first], end + self.tag_shift[last]
+
+    def tags_within(self, start, end):
+        """Return the model string form of the tags within start, end, concatenated."""
+        first = bisect.bisect_left(self.tag_starts, start)
+        last = bisect.bisect_right(self.tag_ends, end)
+        return ''.join(self.data[self.tag_starts[i]:self.tag_ends[i]] for i in range(first, last))
+
+
+class SearchIndex:
+    """Searches and replaces in the model strings of a list of segments.
+
+    Call update() with the row of a segment whose source or target has been
+    changed by others, or without a row after rows have been added or removed.
+
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self._entries = {side: {} for side in SIDES}
+        self._texts = {}
+
+    def update(self, row=None):
+        if row is None:
+            for entries in self._entries.values():
+                entries.clear()
+            self._texts.clear()
+            return
+        for entries in self._entries.values():
+            entries.pop(row, None)
+        for (side, plain), texts in self._texts.items():
+            text = getattr(self.segments[row], side) or ''
+            texts[row] = strip_tags(text) if plain else text
+
+    def entry(self, row, side):
+        entries = self._entries[side]
+        entry = entries.get(row)
+        if entry is None:
+            entry = entries[row] = _Entry(getattr(self.segments[row], side) or '')
+        return entry
+
+    def texts(self, side, plain):
+        """Return the model strings or tag-neutral texts of a side, one per row."""
+        texts = self._texts.get((side, plain))
+        if texts is None:
+            texts = [getattr(segment, side) or '' for segment in self.segments]
+            if plain:
+                texts = list(map(strip_tags, texts))
+            self._texts[side, plain] = texts
+        return texts
+
+    def compile(self, query, mode=LITERAL, case_sensitive=True):
+        flags = re.MULTILINE if case_sensitive else re.MULTILINE | re.IGNORECASE
+        return re.compile(query if mode == REGEX else re.escape(query), flags)
+
+    def find(self, query, mode=LITERAL, sides=SIDES, case_sensitive=True):
+        """Yield a SearchHit for each match, by side and then in row order.
+
+        Each segment is matched on its own, so a match ends at the end of its
+        segment at the latest. Empty matches are skipped.
+
+        """
+        pattern = self.compile(query, mode, case_sensitive)
+        search = pattern.search
+        plain = mode == IGNORE_TAGS
+        for side in sides:
+            for row, text in enumerate(self.texts(side, plain)):
+                if search(text) is None:
+                    continue
+                entry = self.entry(row, side)
+                for match in pattern.finditer(text):
+                    start, end = match.span()
+                    if start == end:
+                        continue
+                    if plain:
+                        start, end = entry.model_span(start, end)
+                    elif entry.inside_tag(start) or entry.inside_tag(end):
+                        continue
+                    yield SearchHit(row, side, start, end, match)
+
+    def replacement(self, hit, replacement, mode=LITERAL):
+        """Return the text that would replace hit."""
+        if mode == REGEX:
+            return hit.match.expand(replacement)
+        if mode == IGNORE_TAGS:
+            return replacement + self.entry(hit.row, hit.side).tags_within(hit.start, hit.end)
+        return replacement
+
+    def _replace_in_row(self, row, side, hits, replacement, mode):
+        entry = self.entry(row, side)
+        data = entry.data
+        parts = []
+        pos = len(data)
+        # the pairs can only break if tags are removed, or if tags are inserted
+        check = False
+        for hit in reversed(hits):
+            parts.append(data[hit.end:pos])
+            text = self.replacement(hit, replacement, mode)
+            if mode != IGNORE_TAGS and entry.has_tags(hit.start, hit.end):
+                check = True
+            elif default_grammar.pattern.search(text) and text != data[hit.start:hit.end]:
+                check = True
+            parts.append(text)
+            pos = hit.start
+        parts.append(data[:pos])
+        result = ''.join(reversed(parts))
+        # tagqa also brings in the XLIFF reader, which searching does not need
+        from tagqa import check_pairs
+        if check and len(check_pairs(result, side)) > len(check_pairs(data, side)):
+            raise TagPairingError(f'replacing in {side} of row {row} would break its tag pairs')
+        setattr(self.segments[row], side, result)
+        self.update(row)
+        return result
+
+    def replace(self, hit, replacement, mode=LITERAL):
+        """Replace one hit and return the new model string of its segment side.
+
+        Raises TagPairingError if the replacement would break the tag pairs.
+
+        """
+        return self._replace_in_row(hit.row, hit.side, [hit], replacement, mode)
+
+    def replace_all(self, query, replacement, mode=LITERAL, sides=('target',), case_sensitive=True):
+        """Replace all matches and return the changed rows and the rows that were refused.
+
+        The matches of a segment side are all replaced or, if that would break
+        its tag pairs, none of them are.
+
+        """
+        hits_by_row = {}
+        for hit in self.find(query, mode, sides, case_sensitive):
+            hits_by_row.setdefault((hit.row, hit.side), []).append(hit)
+        changed = []
+        refused = []
+        for (row, side), hits in hits_by_row.items():
+            try:
+                self._replace_in_row(row, side, hits, replacement, mode)
+            except TagPairingError:
+                refused.append(row)
+            else:
+                changed.append(row)
+        return changed, refused
@@ -0,0 +1,343 @@
+"""
+A binary cache of the parsed segments of XLIFF files.
+
+Parsing a large XLIFF file is the slowest part of opening it. load_segments()
+parses a file once with xliff.read_xliff() and writes its segments to a cache
+file; later calls open the cache with mmap instead, which takes about the same
+time for any size of file. The segments are decoded one at a time, when they
+are first accessed, so opening a project only reads the segments that are
+shown or edited.
+
+The cache is keyed on the path of the XLIFF file and validated against the
+BLAKE2b hash of its contents. The hash is only computed again if the size or
+modification time of the file is not the one recorded in the cache.
+
+Each segment is stored as one record: its key, the text of its source and
+target without tags, their tag tables (offset, TagKind value and the id of
+the tag name, like the properties of a TagTextObject) and the XLIFF elements
+of its tags as JSON. Tag names are stored once, in a table at the end of the
+file.
+
+"""
+
+
+import array
+import collections
+import collections.abc
+import contextlib
+import copy
+import hashlib
+import json
+import mmap
+import os
+import queue
+import struct
+import sys
+import threading
+
+from tags import TagKind, default_grammar
+from xliff import XliffSegment, read_xliff
+
+MAGIC = b'TESC'
+VERSION = 2
+
+# magic, version, byte order, file size, file mtime_ns, file hash, segments, names offset, index offset
+_HEADER = struct.Struct('<4sBB2xQQ32sQQQ')
+# key, source text, source tags, target text (NO_TARGET if None), target tags, tag elements
+_RECORD = struct.Struct('<IIIIII')
+NO_TARGET = 0xFFFFFFFF
+
+_KINDS = {kind.value: kind for kind in TagKind}
+
+# the segments read_and_cache() may parse ahead of the cache writer
+_QUEUE_SIZE = 1024
+_END = object()
+_ABORT = object()
+
+
+class _Aborted(Exception):
+    """Raised to the cache writer of read_and_cache() when not all segments were parsed."""
+
+
+def default_cache_path(path):
+    """Return the cache file for the XLIFF file path, in the user's cache directory."""
+    directory = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    name = hashlib.blake2b(os.path.abspath(path).encode('utf-8'), digest_size=16).hexdigest()
+    return os.path.join(directory, 'tageditor', name + '.segcache')
+
+
+def file_hash(path):
+    digest = hashlib.blake2b(digest_size=32)
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.digest()
+
+
+def _encode_side(data, names):
+    """Return the text, and the tag offsets, kinds and name ids of the model string data."""
+    parts = []
+    offsets = array.array('I')
+    kinds = array.array('B')
+    name_ids = array.array('I')
+    length = 0
+    pos = 0
+    for (start, end), kind, name in default_grammar.scan(data):
+        if start > pos:
+            parts.append(data[pos:start])
+            length += start - pos
+        offsets.append(length)
+        kinds.append(kind.value)
+        name_id = names.get(name)
+        if name_id is None:
+            name_id = names[name] = len(names)
+        name_ids.append(name_id)
+        pos = end
+    if not offsets:
+        return data.encode('utf-8'), b''
+    parts.append(data[pos:])
+    return ''.join(parts).encode('utf-8'), offsets.tobytes() + name_ids.tobytes() + kinds.tobytes()
+
+
+def write_cache(cache_path, path, segments):
+    """Write the XliffSegments of the XLIFF file path to cache_path.
+
+    segments may be an iterator that parses the file as it goes; the file is
+    hashed after the last segment. ValueError is raised if the file changed
+    meanwhile. The cache is left as it was if writing fails.
+
+    """
+    names = {}
+    index = array.array('Q')
+    stat = os.stat(path)
+    os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+    temporary = cache_path + '.tmp'
+    try:
+        with open(temporary, 'wb') as f:
+            f.write(bytes(_HEADER.size))
+            for segment in segments:
+                index.append(f.tell())
+                key = str(segment.key).encode('utf-8')
+                source, source_tags = _encode_side(segment.source, names)
+                if segment.target is None:
+                    target, target_tags = b'', b''
+                else:
+                    target, target_tags = _encode_side(segment.target, names)
+                elements = json.dumps([[name, kind.value, local, attrib, content]
+                                       for (name, kind), (local, attrib, content) in segment.tags.items()],
+                                      ensure_ascii=False).encode('utf-8') if segment.tags else b''
+                f.write(_RECORD.pack(len(key), len(source), len(source_tags) // 9,
+                                     NO_TARGET if segment.target is None else len(target), len(target_tags) // 9,
+                                     len(elements)))
+                f.write(key + source + source_tags + target + target_tags + elements)
+            index.append(f.tell())
+            names_offset = f.tell()
+            f.write(json.dumps(list(names), ensure_ascii=False).encode('utf-8'))
+            # align the index for the memoryview cast
+            f.write(bytes(-f.tell() % 8))
+            index_offset = f.tell()
+            index.tofile(f)
+            digest = file_hash(path)
+            current = os.stat(path)
+            if (current.st_size, current.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+                raise ValueError(f'{path} changed while its cache was written')
+            f.seek(0)
+            f.write(_HEADER.pack(MAGIC, VERSION, sys.byteorder == 'big', stat.st_size, stat.st_mtime_ns, digest,
+                                 len(index) - 1, names_offset, index_offset))
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(temporary)
+        raise
+    os.replace(temporary, cache_path)
+
+
+class CachedSegments(collections.abc.Sequence):
+    """The segments in a cache file, decoded on first access.
+
+    A decoded XliffSegment is kept, so changes made to it last as long as
+    the CachedSegments.
+
+    """
+
+    def __init__(self, cache_path):
+        self.index = None
+        self.file = open(cache_path, 'rb')
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file cannot be mapped
+            self.file.close()
+            raise ValueError(f'{cache_path} is not a segment cache')
+        header = _HEADER.unpack_from(self.map) if len(self.map) >= _HEADER.size else None
+        if header is None or header[0] != MAGIC or header[1] != VERSION or header[2] != (sys.byteorder == 'big'):
+            self.close()
+            raise ValueError(f'{cache_path} is not a segment cache')
+        (magic, version, big_endian, self.file_size, self.file_mtime, self.digest, count, names_offset,
+         index_offset) = header
+        self.path = cache_path
+        self.index = memoryview(self.map)[index_offset:index_offset + 8 * (count + 1)].cast('Q')
+        self.names = json.loads(str(self.map[names_offset:index_offset], 'utf-8').rstrip('\0'))
+        self.decoded = {}
+
+    def close(self):
+        if self.index is not None:
+            self.index.release()
+            self.index = None
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def is_valid_for(self, path):
+        """Return True if the cache holds the segments of the XLIFF file path as it is now."""
+        stat = os.stat(path)
+        if stat.st_size != self.file_size:
+            return False
+        if stat.st_mtime_ns == self.file_mtime:
+            return True
+        return file_hash(path) == self.digest
+
+    def refresh_stat(self, path):
+        """Record the current size and modification time of path, after is_valid_for() hashed it."""
+        stat = os.stat(path)
+        with open(self.path, 'r+b') as f:
+            f.write(_HEADER.pack(MAGIC, VERSION, sys.byteorder == 'big', stat.st_size, stat.st_mtime_ns, self.digest,
+                                 len(self), *_HEADER.unpack_from(self.map)[-2:]))
+        self.file_size = stat.st_size
+        self.file_mtime = stat.st_mtime_ns
+
+    def __len__(self):
+        return len(self.index) - 1
+
+    def __getitem__(self, row):
+        if isinstance(row, slice):
+            return [self[i] for i in range(*row.indices(len(self)))]
+        if row < 0:
+            row += len(self)
+        segment = self.decoded.get(row)
+        if segment is None:
+            if not 0 <= row < len(self):
+                raise IndexError(row)
+            segment = self.decoded[row] = self.decode(row)
+        return segment
+
+    def decode(self, row):
+        data = self.map
+        pos = self.index[row]
+        key_size, source_size, source_tags, target_size, target_tags, elements_size = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        key = str(data[pos:pos + key_size], 'utf-8')
+        pos += key_size
+        source, pos = self._decode_side(data, pos, source_size, source_tags)
+        target = None
+        if target_size != NO_TARGET:
+            target, pos = self._decode_side(data, pos, target_size, target_tags)
+        tags = {}
+        if elements_size:
+            for name, kind, local, attrib, content in json.loads(str(data[pos:pos + elements_size], 'utf-8')):
+                tags[name, _KINDS[kind]] = (local, attrib, content)
+        return XliffSegment(key, source, target, tags)
+
+    def _decode_side(self, data, pos, size, count):
+        """Return the model string of a side and the position after it."""
+        text = str(data[pos:pos + size], 'utf-8')
+        pos += size
+        if not count:
+            return text, pos
+        offsets = array.array('I', data[pos:pos + 4 * count])
+        name_ids = array.array('I', data[pos + 4 * count:pos + 8 * count])
+        kinds = data[pos + 8 * count:pos + 9 * count]
+        parts = []
+        last = 0
+        for offset, name_id, kind in zip(offsets, name_ids, kinds):
+            parts.append(text[last:offset])
+            parts.append(default_grammar.stringify(self.names[name_id], _KINDS[kind]))
+            last = offset
+        parts.append(text[last:])
+        return ''.join(parts), pos + 9 * count
+
+
+def open_cache(path, cache_path=None):
+    """Return the CachedSegments of the XLIFF file path if its cache is still valid, otherwise None."""
+    cache_path = cache_path or default_cache_path(path)
+    if not os.path.exists(cache_path):
+        return None
+    try:
+        segments = CachedSegments(cache_path)
+    except (OSError, ValueError, struct.error):
+        return None
+    if segments.is_valid_for(path):
+        if segments.file_mtime != os.stat(path).st_mtime_ns:
+            segments.refresh_stat(path)
+        return segments
+    segments.close()
+    return None
+
+
+def load_segments(path, cache_path=None):
+    """Return the segments of the XLIFF file path, from its cache if that is still valid.
+
+    Otherwise the file is parsed and the cache written first.
+
+    """
+    cache_path = cache_path or default_cache_path(path)
+    segments = open_cache(path, cache_path)
+    if segments is not None:
+        return segments
+    write_cache(cache_path, path, read_xliff(path))
+    return CachedSegments(cache_path)
+
+
+def read_and_cache(path, cache_path=None):
+    """Yield the XliffSegments of the XLIFF file path as they are parsed, and write its cache meanwhile.
+
+    Copies of the segments are handed to a writer thread through a bounded
+    queue as they are yielded, so changes made to the yielded segments do not
+    end up in the cache, and only the copies that have not been written yet
+    are held. The thread hashes the file after the last segment, so that the
+    last segment does not wait for it; the thread is not a daemon, so the
+    cache is complete before the program exits. No cache is written if not
+    all segments are read.
+
+    """
+    segments = queue.Queue(_QUEUE_SIZE)
+    threading.Thread(target=_write_queued, args=(cache_path or default_cache_path(path), path, segments),
+                     name='segcache').start()
+    try:
+        for segment in read_xliff(path):
+            segments.put(copy.copy(segment))
+            yield segment
+    except BaseException:
+        segments.put(_ABORT)
+        raise
+    segments.put(_END)
+
+
+def _queued_segments(segments):
+    """Yield the segments put on the queue segments until _END, raising _Aborted at _ABORT."""
+    while True:
+        try:
+            item = segments.get(timeout=1)
+        except queue.Empty:
+            if not threading.main_thread().is_alive():
+                # the program is exiting before all segments were read
+                raise _Aborted()
+            continue
+        if item is _END:
+            return
+        if item is _ABORT:
+            raise _Aborted()
+        yield item
+
+
+def _write_queued(cache_path, path, segments):
+    items = _queued_segments(segments)
+    try:
+        write_cache(cache_path, path, items)
+    except _Aborted:
+        pass
+    except BaseException:
+        # take the rest of the segments, so that read_and_cache() never waits on a full queue
+        with contextlib.suppress(_Aborted):
+            collections.deque(items, maxlen=0)
+        raise
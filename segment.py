@@ -0,0 +1,138 @@
+"""
+A compact, Qt-free representation of a tagged segment.
+
+A Segment keeps its text without tags as one string. Its tags are stored in
+parallel arrays: the offset of each tag in the text, its TagKind value, and
+the ids of its name and tooltip in the module-wide tag_names and tooltips
+tables. Segments without tags share the same empty arrays, so holding
+millions of segments costs little more than their text.
+
+Segments are immutable. Use TagTextEdit.to_segment() and from_segment() to
+convert them from and to a document.
+
+"""
+
+
+from array import array
+
+from tags import TagKind, default_grammar
+
+
+class NameTable:
+    """Interns strings as small integer ids."""
+    __slots__ = ('ids', 'names')
+
+    def __init__(self):
+        self.ids = {}
+        self.names = []
+
+    def intern(self, name):
+        name_id = self.ids.get(name)
+        if name_id is None:
+            name_id = self.ids[name] = len(self.names)
+            self.names.append(name)
+        return name_id
+
+    def __getitem__(self, name_id):
+        return self.names[name_id]
+
+    def __len__(self):
+        return len(self.names)
+
+
+tag_names = NameTable()
+tooltips = NameTable()
+
+_KINDS = {kind.value: kind for kind in TagKind}
+_NO_OFFSETS = array('I')
+_NO_KINDS = array('B')
+_NO_IDS = array('I')
+
+
+class Segment:
+    """A segment's text with its tags in parallel arrays.
+
+    tags is an iterable of (offset, name, kind, tooltip) tuples in text order,
+    where offset is the index in text the tag precedes. A tooltip of None
+    defaults to the tag name.
+
+    """
+    __slots__ = ('text', 'offsets', 'kinds', 'name_ids', 'tooltip_ids')
+
+    def __init__(self, text='', tags=()):
+        self.text = text
+        offsets = array('I')
+        kinds = array('B')
+        name_ids = array('I')
+        tooltip_ids = array('I')
+        for offset, name, kind, tooltip in tags:
+            offsets.append(offset)
+            kinds.append(kind.value)
+            name_ids.append(tag_names.intern(name))
+            tooltip_ids.append(tooltips.intern(name if tooltip is None else tooltip))
+        if offsets:
+            self.offsets = offsets
+            self.kinds = kinds
+            self.name_ids = name_ids
+            self.tooltip_ids = tooltip_ids
+        else:
+            self.offsets = _NO_OFFSETS
+            self.kinds = _NO_KINDS
+            self.name_ids = self.tooltip_ids = _NO_IDS
+
+    @classmethod
+    def from_model(cls, data):
+        """Return the Segment encoded in the model string data, see TagTextEdit.to_model_data()."""
+        parts = []
+        tags = []
+        length = 0
+        pos = 0
+        for (start, end), kind, name in default_grammar.scan(data):
+            if start > pos:
+                parts.append(data[pos:start])
+                length += start - pos
+            tags.append((length, name, kind, None))
+            pos = end
+        if not tags:
+            return cls(data)
+        parts.append(data[pos:])
+        return cls(''.join(parts), tags)
+
+    def to_model(self):
+        """Return the segment as a model string."""
+        if not self.offsets:
+            return self.text
+        text = self.text
+        stringify = default_grammar.stringify
+        parts = []
+        pos = 0
+        for offset, kind, name_id in zip(self.offsets, self.kinds, self.name_ids):
+            parts.append(text[pos:offset])
+            pos = offset
+            parts.append(stringify(tag_names[name_id], _KINDS[kind]))
+        parts.append(text[pos:])
+        return ''.join(parts)
+
+    def tags(self):
+        """Yield the (offset, name, kind, tooltip) tuples of the tags."""
+        for offset, kind, name_id, tooltip_id in zip(self.offsets, self.kinds, self.name_ids, self.tooltip_ids):
+            yield offset, tag_names[name_id], _KINDS[kind], tooltips[tooltip_id]
+
+    def __len__(self):
+        return len(self.text) + len(self.offsets)
+
+    def __eq__(self, other):
+        if not isinstance(other, Segment):
+            return NotImplemented
+        return (self.text == other.text and self.offsets == other.offsets and self.kinds == other.kinds
+                and self.name_ids == other.name_ids and self.tooltip_ids == other.tooltip_ids)
+
+    def __hash__(self):
+        return hash((self.text, self.offsets.tobytes(), self.kinds.tobytes(), self.name_ids.tobytes()))
+
+    def __reduce__(self):
+        # ids are only meaningful within this process, so pickle the names themselves
+        return Segment, (self.text, list(self.tags()))
+
+    def __repr__(self):
+        return f'Segment({self.to_model()!r})'
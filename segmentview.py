@@ -0,0 +1,390 @@
+"""
+A virtualized view over all the segments of a file.
+
+SegmentModel keeps the segments as model strings. SegmentView shows them in a
+table with fixed row heights, so scrolling never needs to measure rows that
+are not shown. SegmentDelegate paints the rows from the model strings through
+one shared QTextDocument and keeps the results in a bounded pixmap cache.
+Only the current row gets a real TagTextEdit, which is checked out of an
+EditorPool and returned to it when the row is left. While a row is edited, a
+LiveTagDiff underlines the target tags that are extra, moved or wrongly
+nested compared with the source, and LiveQA runs the qachecks checks on a
+worker thread.
+
+All documents share one TagTextObject handler, and all editors share one
+BoundaryHandler.
+
+"""
+
+
+from startup import STARTED
+import collections.abc
+from collections import OrderedDict
+import itertools
+
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QRectF, QSize, QTimer, pyqtSignal
+from PyQt5.QtGui import QAbstractTextDocumentLayout, QPainter, QPalette, QPixmap, QTextDocument, QTextOption
+from PyQt5.QtWidgets import QApplication, QHeaderView, QStyle, QStyledItemDelegate, QStyleOptionViewItem, \
+    QTableView
+
+from main import KeyEventFilter, LiveQA, LiveTagDiff, TagTextEdit, TagTextObject, TimedBoundaryHandler, fill_document
+from search import LITERAL, SearchIndex
+
+
+class SegmentModel(QAbstractTableModel):
+    """A table of segments with a source and a target column.
+
+    The segments are objects with source and target attributes holding model
+    strings, such as the XliffSegments yielded by xliff.read_xliff(). A
+    sequence of segments, such as segcache.CachedSegments, is used as is,
+    so that its segments are only accessed when they are shown.
+
+    Segments from any other iterable are read as they are needed: the first
+    screen of first_rows when the model is created, and more through
+    fetchMore() when the view scrolls to the end or in batches from the
+    event loop after load_in_background(). loaded is emitted when the last
+    segment has been read.
+
+    """
+    SOURCE = 0
+    TARGET = 1
+    headers = ('Source', 'Target')
+    first_rows = 100
+    batch_rows = 2000
+    loaded = pyqtSignal()
+
+    def __init__(self, segments=(), parent=None):
+        super().__init__(parent)
+        self._search_index = None
+        if isinstance(segments, collections.abc.Sequence):
+            self.segments = segments
+            self.pending = None
+            return
+        self.segments = []
+        self.pending = iter(segments)
+        self.segments.extend(itertools.islice(self.pending, self.first_rows))
+        if len(self.segments) < self.first_rows:
+            self.pending = None
+
+    def search_index(self):
+        """Return the SearchIndex of the segments, which the model keeps up to date."""
+        if self._search_index is None:
+            self.fetch_all()
+            self._search_index = SearchIndex(self.segments)
+        return self._search_index
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.pending is not None
+
+    def fetchMore(self, parent=QModelIndex()):
+        if self.canFetchMore(parent):
+            self.fetch_rows(self.batch_rows)
+
+    def fetch_rows(self, count):
+        """Read up to count more segments; return False when all have been read."""
+        if self.pending is None:
+            return False
+        batch = list(itertools.islice(self.pending, count))
+        if batch:
+            row = len(self.segments)
+            self.beginInsertRows(QModelIndex(), row, row + len(batch) - 1)
+            self.segments.extend(batch)
+            self.endInsertRows()
+        if len(batch) < count:
+            self.pending = None
+            self.loaded.emit()
+            return False
+        return True
+
+    def fetch_all(self):
+        while self.fetch_rows(self.batch_rows):
+            pass
+
+    def load_in_background(self):
+        """Read the remaining segments in batches of batch_rows, returning to the event loop in between."""
+        if self.fetch_rows(self.batch_rows):
+            QTimer.singleShot(0, self.load_in_background)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.segments)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else 2
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role not in (Qt.DisplayRole, Qt.EditRole):
+            return None
+        segment = self.segments[index.row()]
+        if index.column() == self.SOURCE:
+            return segment.source
+        return segment.target or ''
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or index.column() != self.TARGET or role != Qt.EditRole:
+            return False
+        segment = self.segments[index.row()]
+        if segment.target == value:
+            return False
+        segment.target = value
+        if self._search_index is not None:
+            self._search_index.update(index.row())
+        self.dataChanged.emit(index, index, [Qt.DisplayRole, Qt.EditRole])
+        return True
+
+    def replace_all(self, query, replacement, mode=LITERAL, case_sensitive=True):
+        """Replace in all targets, see SearchIndex.replace_all()."""
+        changed, refused = self.search_index().replace_all(query, replacement, mode, ('target',), case_sensitive)
+        if changed:
+            self.dataChanged.emit(self.index(min(changed), self.TARGET), self.index(max(changed), self.TARGET),
+                                  [Qt.DisplayRole, Qt.EditRole])
+        return changed, refused
+
+    def flags(self, index):
+        flags = super().flags(index)
+        if index.isValid() and index.column() == self.TARGET:
+            flags |= Qt.ItemIsEditable
+        return flags
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.headers[section]
+        return super().headerData(section, orientation, role)
+
+
+def _text_option():
+    option = QTextOption()
+    option.setFlags(QTextOption.ShowTabsAndSpaces | QTextOption.ShowLineAndParagraphSeparators)
+    option.setWrapMode(QTextOption.WrapAtWordBoundaryOrAnywhere)
+    return option
+
+
+class EditorPool:
+    """Hands out TagTextEdits, reusing the ones that were checked in."""
+
+    def __init__(self, size=4):
+        self.size = size
+        self.free = []
+        self.tag_object = TagTextObject()
+        self.boundary_handler = TimedBoundaryHandler()
+
+    def register_tag_type(self, doc):
+        doc.documentLayout().registerHandler(TagTextObject.type, self.tag_object)
+
+    def create_editor(self, parent):
+        editor = TagTextEdit(parent)
+        self.register_tag_type(editor.document())
+        self.boundary_handler.install_textedit(editor)
+        # installed last so that it sees key presses first, see KeyEventFilter.install_to()
+        editor.key_event_filter = KeyEventFilter()
+        editor.key_event_filter.install_to(editor)
+        editor.textChanged.connect(editor.recognize_tags)
+        return editor
+
+    def checkout(self, parent):
+        if self.free:
+            editor = self.free.pop()
+            editor.setParent(parent)
+            return editor
+        return self.create_editor(parent)
+
+    def checkin(self, editor):
+        editor.hide()
+        if len(self.free) >= self.size:
+            editor.deleteLater()
+            return
+        # drop the content and the undo history of the segment
+        editor.from_model_data('')
+        editor.setParent(None)
+        self.free.append(editor)
+
+    def clear_cache(self):
+        self.tag_object.clear_cache()
+
+
+class SegmentDelegate(QStyledItemDelegate):
+    """Paints segments from their model strings and edits them with pooled TagTextEdits."""
+    pixmap_cache_limit = 512
+    # segments longer than this are laid out lazily in the editor
+    lazy_layout_length = 10000
+
+    def __init__(self, pool, parent=None):
+        super().__init__(parent)
+        self.pool = pool
+        self.document = QTextDocument(self)
+        self.document.setDefaultTextOption(_text_option())
+        self.document.setDocumentMargin(2)
+        pool.register_tag_type(self.document)
+        self.pixmap_cache = OrderedDict()
+
+    def clear_cache(self):
+        self.pixmap_cache.clear()
+
+    def paint(self, painter, option, index):
+        opt = QStyleOptionViewItem(option)
+        self.initStyleOption(opt, index)
+        opt.text = ''
+        style = opt.widget.style() if opt.widget is not None else QApplication.style()
+        style.drawControl(QStyle.CE_ItemViewItem, opt, painter, opt.widget)
+        data = index.data(Qt.EditRole)
+        if not data:
+            return
+        selected = bool(opt.state & QStyle.State_Selected)
+        color = opt.palette.color(QPalette.HighlightedText if selected else QPalette.Text)
+        ratio = painter.device().devicePixelRatioF()
+        size = opt.rect.size()
+        key = (data, size.width(), size.height(), ratio, opt.font.key(), color.rgba())
+        pixmap = self.pixmap_cache.get(key)
+        if pixmap is None:
+            pixmap = self.render_segment(data, size, ratio, opt.font, color)
+            self.pixmap_cache[key] = pixmap
+            if len(self.pixmap_cache) > self.pixmap_cache_limit:
+                self.pixmap_cache.popitem(last=False)
+        else:
+            self.pixmap_cache.move_to_end(key)
+        painter.drawPixmap(opt.rect.topLeft(), pixmap)
+
+    def render_segment(self, data, size, ratio, font, color):
+        fill_document(self.document, data)
+        self.document.setDefaultFont(font)
+        self.document.setTextWidth(size.width())
+        pixmap = QPixmap(QSize(round(size.width() * ratio), round(size.height() * ratio)))
+        pixmap.setDevicePixelRatio(ratio)
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        context = QAbstractTextDocumentLayout.PaintContext()
+        context.palette.setColor(QPalette.Text, color)
+        context.clip = QRectF(0, 0, size.width(), size.height())
+        painter.setClipRect(context.clip)
+        self.document.documentLayout().draw(painter, context)
+        painter.end()
+        return pixmap
+
+    def createEditor(self, parent, option, index):
+        editor = self.pool.checkout(parent)
+        editor.setFont(option.font)
+        return editor
+
+    def destroyEditor(self, editor, index):
+        self.pool.checkin(editor)
+
+    def setEditorData(self, editor, index):
+        data = index.data(Qt.EditRole) or ''
+        editor.set_lazy_layout(len(data) > self.lazy_layout_length)
+        editor.from_model_data(data)
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.to_model_data(), Qt.EditRole)
+
+    def updateEditorGeometry(self, editor, option, index):
+        editor.setGeometry(option.rect)
+
+
+class SegmentView(QTableView):
+    """A table of segments in which only the current row is backed by an editor."""
+    lines_per_row = 3
+
+    def __init__(self, model=None, parent=None):
+        super().__init__(parent)
+        self.pool = EditorPool()
+        self.setItemDelegate(SegmentDelegate(self.pool, self))
+        self.setEditTriggers(QTableView.NoEditTriggers)
+        self.setWordWrap(True)
+        self.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        # fixed row heights keep scrolling independent of the number of segments
+        header = self.verticalHeader()
+        header.setSectionResizeMode(QHeaderView.Fixed)
+        header.setDefaultSectionSize(self.fontMetrics().lineSpacing() * self.lines_per_row + 8)
+        self.active_row = None
+        self.tag_diff = None
+        self.qa = None
+        self.autosaver = None
+        if model is not None:
+            self.setModel(model)
+
+    def target_index(self, row):
+        return self.model().index(row, SegmentModel.TARGET)
+
+    def segment_key(self, row):
+        return getattr(self.model().segments[row], 'key', row)
+
+    def open_editor(self, row):
+        index = self.target_index(row)
+        self.openPersistentEditor(index)
+        self.active_row = row
+        editor = self.indexWidget(index)
+        if editor is None:
+            return
+        source = self.model().segments[row].source
+        self.tag_diff = LiveTagDiff(editor, source, parent=self)
+        self.qa = LiveQA(editor, source, parent=self)
+        if self.autosaver is not None:
+            self.autosaver.watch(editor, self.segment_key(row))
+
+    def close_editor(self):
+        if self.active_row is None:
+            return
+        index = self.target_index(self.active_row)
+        editor = self.indexWidget(index)
+        if self.tag_diff is not None:
+            self.tag_diff.close()
+            self.tag_diff.deleteLater()
+            self.tag_diff = None
+        if self.qa is not None:
+            self.qa.close()
+            self.qa.deleteLater()
+            self.qa = None
+        if editor is not None:
+            if self.autosaver is not None:
+                self.autosaver.unwatch(editor)
+            # a paste still running belongs to this row, not to the row the editor is reused for
+            editor.complete_clipboard_job()
+            self.commitData(editor)
+        self.closePersistentEditor(index)
+        self.active_row = None
+
+    def currentChanged(self, current, previous):
+        super().currentChanged(current, previous)
+        row = current.row() if current.isValid() else None
+        if row == self.active_row:
+            return
+        self.close_editor()
+        if row is not None:
+            self.open_editor(row)
+
+    def zoom(self, delta):
+        font = self.font()
+        font.setPointSize(max(1, font.pointSize() + delta))
+        self.pool.clear_cache()
+        self.itemDelegate().clear_cache()
+        self.setFont(font)
+        self.verticalHeader().setDefaultSectionSize(self.fontMetrics().lineSpacing() * self.lines_per_row + 8)
+
+
+if __name__ == '__main__':
+    import os
+    import sys
+
+    import latency
+    from segcache import open_cache, read_and_cache
+
+    app = QApplication(sys.argv)
+    # without a valid cache the first screen is shown while the rest of the file is parsed
+    segments = open_cache(sys.argv[1])
+    model = SegmentModel(read_and_cache(sys.argv[1]) if segments is None else segments)
+    view = SegmentView(model)
+    first_paint = latency.FirstPaintTimer(view.viewport(), STARTED)
+    first_paint.painted.connect(model.load_in_background)
+    if os.environ.get('TAGEDITOR_STARTUP'):
+        latency.report_startup(first_paint, os.environ['TAGEDITOR_STARTUP'])
+    if os.environ.get('TAGEDITOR_AUTOSAVE'):
+        from autosave import AutoSaver
+        view.autosaver = AutoSaver(os.environ['TAGEDITOR_AUTOSAVE'])
+        if view.autosaver.recovered:
+            model.fetch_all()
+            for row, segment in enumerate(model.segments):
+                if segment.key in view.autosaver.recovered:
+                    model.setData(model.index(row, SegmentModel.TARGET), view.autosaver.recovered[segment.key])
+        app.aboutToQuit.connect(view.autosaver.close)
+    view.resize(1000, 700)
+    view.show()
+    sys.exit(app.exec_())
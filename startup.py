@@ -0,0 +1,12 @@
+"""
+The time the program started, for the time to first paint.
+
+main.py and segmentview.py import STARTED from this module before any other
+import, so that it is taken before the slow imports.
+
+"""
+
+
+import time
+
+STARTED = time.perf_counter()
@@ -0,0 +1,204 @@
+"""
+Tag-consistency diff between the source and the target of a segment.
+
+A segment's tags are compared as sequences of (name, kind) pairs. The n-th
+occurrence of a tag in the target is matched with its n-th occurrence in the
+source. Source tags without a match are missing, target tags without a match
+are extra. Of the matched target tags, the longest run that keeps the source
+order stays in place and the others are moved; the run is found as a longest
+increasing subsequence, so a diff takes O(n log n) for n tags. Finally the
+matched target tags are checked for pairs that are closed in the wrong order.
+This module does not depend on Qt.
+
+diff_all() diffs many segments on a process or thread pool and yields the
+results in order. In the editor, main.LiveTagDiff keeps a diff of a
+TagTextEdit against its source up to date as the target is edited.
+
+"""
+
+
+import bisect
+import collections
+import concurrent.futures
+import itertools
+import os
+
+from tags import TagKind, default_grammar, iter_tags
+
+MISSING = 'missing'
+EXTRA = 'extra'
+MOVED = 'moved'
+NESTING = 'nesting'
+
+
+class TagIssue(collections.namedtuple('TagIssue', 'code index name kind')):
+    """A tag that differs between source and target.
+
+    index is the position of the tag in the source's tag sequence for missing
+    tags, and in the target's tag sequence for the other codes.
+
+    """
+    __slots__ = ()
+
+    @property
+    def side(self):
+        return 'source' if self.code == MISSING else 'target'
+
+
+class TagDiff:
+    """The issues of one segment, in the order of the tags they refer to."""
+    __slots__ = ('issues',)
+
+    def __init__(self, issues=()):
+        self.issues = list(issues)
+
+    def __bool__(self):
+        return bool(self.issues)
+
+    def __iter__(self):
+        return iter(self.issues)
+
+    def __len__(self):
+        return len(self.issues)
+
+    def __eq__(self, other):
+        return isinstance(other, TagDiff) and self.issues == other.issues
+
+    def __repr__(self):
+        return f'TagDiff({self.issues!r})'
+
+    def target_issues(self):
+        """Return a dict mapping the index of each target tag with an issue to its code."""
+        return {issue.index: issue.code for issue in self.issues if issue.code != MISSING}
+
+    def missing(self):
+        return [issue for issue in self.issues if issue.code == MISSING]
+
+
+def _increasing_run(values):
+    """Return the set of indices into values of a longest strictly increasing subsequence."""
+    tails = []
+    tail_indices = []
+    previous = [None] * len(values)
+    for index, value in enumerate(values):
+        position = bisect.bisect_left(tails, value)
+        if position == len(tails):
+            tails.append(value)
+            tail_indices.append(index)
+        else:
+            tails[position] = value
+            tail_indices[position] = index
+        previous[index] = tail_indices[position - 1] if position else None
+    run = set()
+    index = tail_indices[-1] if tail_indices else None
+    while index is not None:
+        run.add(index)
+        index = previous[index]
+    return run
+
+
+def diff_tags(source, target):
+    """Return the TagDiff of two sequences of (name, kind) tags."""
+    occurrences = collections.defaultdict(list)
+    for index, tag in enumerate(source):
+        occurrences[tag].append(index)
+    used = collections.Counter()
+    matched_source = [None] * len(source)
+    # (target index, source index) of the matched target tags, in target order
+    matches = []
+    issues = []
+    for index, tag in enumerate(target):
+        candidates = occurrences.get(tag)
+        count = used[tag]
+        if candidates is None or count >= len(candidates):
+            issues.append(TagIssue(EXTRA, index, tag[0], tag[1]))
+            continue
+        used[tag] = count + 1
+        matched_source[candidates[count]] = index
+        matches.append((index, candidates[count]))
+    in_place = _increasing_run([source_index for _, source_index in matches])
+    for position, (index, _) in enumerate(matches):
+        if position not in in_place:
+            name, kind = target[index]
+            issues.append(TagIssue(MOVED, index, name, kind))
+    issues.extend(_nesting_issues(target, (index for index, _ in matches)))
+    issues.sort(key=lambda issue: issue.index)
+    missing = [TagIssue(MISSING, index, name, kind) for index, (name, kind) in enumerate(source)
+               if matched_source[index] is None]
+    return TagDiff(missing + issues)
+
+
+def _nesting_issues(target, indices):
+    """Yield an issue for each matched end tag in target that closes a pair crossing another pair.
+
+    Only names with as many matched start as end tags are checked, so that a missing or extra tag
+    is not reported again as a nesting issue.
+
+    """
+    indices = list(indices)
+    balance = collections.Counter()
+    for index in indices:
+        name, kind = target[index]
+        if kind == TagKind.START:
+            balance[name] += 1
+        elif kind == TagKind.END:
+            balance[name] -= 1
+    stack = []
+    for index in indices:
+        name, kind = target[index]
+        if kind == TagKind.EMPTY or balance[name]:
+            continue
+        if kind == TagKind.START:
+            stack.append(name)
+        elif stack and stack[-1] == name:
+            stack.pop()
+        elif name in stack:
+            # close the crossing pair, so that one mistake is reported once
+            del stack[len(stack) - 1 - stack[::-1].index(name)]
+            yield TagIssue(NESTING, index, name, kind)
+
+
+def model_tags(data):
+    """Return the (name, kind) tags of the model string data."""
+    return [(name, kind) for start, end, name, kind in iter_tags(data)]
+
+
+def diff_segment(source, target):
+    """Return the TagDiff of the model strings source and target; a target of None has no issues."""
+    if target is None:
+        return TagDiff()
+    return diff_tags(model_tags(source), model_tags(target))
+
+
+def diff_chunk(chunk):
+    """Diff a list of (key, source, target) tuples, returning a list of (key, TagDiff)."""
+    return [(key, diff_segment(source, target)) for key, source, target in chunk]
+
+
+def diff_all(segments, jobs=None, chunk_size=1000, threads=False):
+    """Yield (key, TagDiff) for each (key, source, target) tuple in segments, in order.
+
+    The segments are diffed in chunks on a process pool, or on a thread pool
+    if threads is True, which saves starting processes for small batches.
+    Only a bounded number of chunks is in flight, so segments may be a lazy
+    iterable over a whole project.
+
+    """
+    jobs = jobs or os.cpu_count() or 1
+    segments = iter(segments)
+    if threads:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+    else:
+        syntaxes = list(default_grammar.enabled)
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=default_grammar.set_enabled,
+                                                          initargs=(syntaxes,))
+    with executor:
+        pending = collections.deque()
+        while True:
+            chunk = list(itertools.islice(segments, chunk_size))
+            if chunk:
+                pending.append(executor.submit(diff_chunk, chunk))
+            while pending and (not chunk or len(pending) > jobs * 2):
+                yield from pending.popleft().result()
+            if not chunk:
+                return
@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Headless tag QA for XLIFF files.
+
+Checks every segment for start tags that are never closed, end tags without a
+start tag, crossing tag pairs, and targets whose tags differ from the source.
+Segments are read with xliff.read_xliff() and checked in chunks on a process
+pool; when there are at least as many files as workers, each worker parses
+and checks whole files instead. With fewer files than workers, the files are
+parsed in the main process, which then limits how fast the workers are fed.
+The report is streamed as JSON lines, one per segment with issues, followed
+by a summary line per file. A file that cannot be read or parsed gets an
+error line before its summary, and the other files are still checked.
+Neither Qt nor a QApplication is needed.
+
+usage: tagqa.py [-j JOBS] [--chunk-size N] [-o REPORT] [--syntax NAME]... FILE...
+
+"""
+
+
+import argparse
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import sys
+
+from tags import TagKind, default_grammar, iter_tags, stringify_tag
+from xliff import read_xliff
+
+# the errors of reading or parsing a file, which are reported for that file only
+_FILE_ERRORS = (OSError, SyntaxError, ValueError)
+
+
+def check_pairs(data, side):
+    """Return the issues with the tag pairs of one side of a segment."""
+    issues = []
+    stack = []
+    for start, end, name, kind in iter_tags(data):
+        if kind == TagKind.START:
+            stack.append(name)
+        elif kind == TagKind.END:
+            if stack and stack[-1] == name:
+                stack.pop()
+            elif name in stack:
+                issues.append({'code': 'crossing', 'side': side, 'tag': stringify_tag(name, kind), 'offset': start})
+                stack.remove(name)
+            else:
+                issues.append({'code': 'unmatched-end', 'side': side, 'tag': stringify_tag(name, kind),
+                               'offset': start})
+    for name in stack:
+        issues.append({'code': 'unclosed-start', 'side': side, 'tag': stringify_tag(name, TagKind.START)})
+    return issues
+
+
+def check_segment(source, target):
+    """Return the tag issues of a segment as a list of dicts."""
+    issues = check_pairs(source, 'source')
+    if target is None:
+        return issues
+    issues.extend(check_pairs(target, 'target'))
+    source_tags = collections.Counter((name, kind) for start, end, name, kind in iter_tags(source))
+    target_tags = collections.Counter((name, kind) for start, end, name, kind in iter_tags(target))
+    for (name, kind), count in sorted((source_tags - target_tags).items(), key=str):
+        issues.append({'code': 'missing', 'side': 'target', 'tag': stringify_tag(name, kind), 'count': count})
+    for (name, kind), count in sorted((target_tags - source_tags).items(), key=str):
+        issues.append({'code': 'extra', 'side': 'target', 'tag': stringify_tag(name, kind), 'count': count})
+    return issues
+
+
+def check_chunk(chunk):
+    """Check a list of (key, source, target) tuples, returning (key, issues) for the failing ones."""
+    results = []
+    for key, source, target in chunk:
+        issues = check_segment(source, target)
+        if issues:
+            results.append((key, issues))
+    return len(chunk), results
+
+
+def check_file(path):
+    """Parse and check a whole file in one worker, one segment at a time.
+
+    Only the segments with issues are kept, so the worker's memory does not grow with the file.
+
+    """
+    checked = 0
+    results = []
+    for segment in read_xliff(path):
+        checked += 1
+        issues = check_segment(segment.source, segment.target)
+        if issues:
+            results.append((segment.key, issues))
+    return checked, results
+
+
+def iter_chunks(path, chunk_size):
+    segments = ((segment.key, segment.source, segment.target) for segment in read_xliff(path))
+    while True:
+        chunk = list(itertools.islice(segments, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run(paths, out, jobs=None, chunk_size=1000, syntaxes=None):
+    """Check the files and write the report to out.
+
+    Return the number of segments with issues plus the number of files that
+    could not be checked.
+
+    syntaxes names the tag syntaxes of tags.default_grammar to enable, in the workers as well.
+
+    """
+    jobs = jobs or os.cpu_count() or 1
+    syntaxes = list(syntaxes or default_grammar.enabled)
+    default_grammar.set_enabled(syntaxes)
+    totals = {path: [0, 0] for path in paths}
+    errors = {}
+    failed = 0
+
+    def report(path, future):
+        # a None future marks the end of a file
+        if future is None:
+            checked, failing = totals[path]
+            if path in errors:
+                out.write(json.dumps({'file': path, 'error': errors[path]}, ensure_ascii=False) + '\n')
+            out.write(json.dumps({'file': path, 'summary': {'segments': checked, 'failed': failing}}) + '\n')
+            out.flush()
+            return 1 if path in errors else 0
+        try:
+            checked, results = future.result()
+        except _FILE_ERRORS as error:
+            errors.setdefault(path, str(error))
+            return 0
+        for key, issues in results:
+            out.write(json.dumps({'file': path, 'key': key, 'issues': issues}, ensure_ascii=False) + '\n')
+        totals[path][0] += checked
+        totals[path][1] += len(results)
+        return len(results)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs, initializer=default_grammar.set_enabled,
+                                                initargs=(syntaxes,)) as executor:
+        pending = collections.deque()
+        for path in paths:
+            if len(paths) >= jobs:
+                # with enough files to go around, workers parse them as well
+                pending.append((path, executor.submit(check_file, path)))
+                pending.append((path, None))
+                while len(pending) > jobs * 4:
+                    failed += report(*pending.popleft())
+                continue
+            try:
+                for chunk in iter_chunks(path, chunk_size):
+                    pending.append((path, executor.submit(check_chunk, chunk)))
+                    # keep a bounded number of chunks in flight so memory stays flat
+                    while len(pending) > jobs * 2:
+                        failed += report(*pending.popleft())
+            except _FILE_ERRORS as error:
+                errors.setdefault(path, str(error))
+            pending.append((path, None))
+        while pending:
+            failed += report(*pending.popleft())
+    return failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Check the tags of XLIFF files.')
+    parser.add_argument('files', nargs='+', metavar='FILE', help='XLIFF 1.2 or 2.0 files')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=1000, help='segments per work item')
+    parser.add_argument('-o', '--output', default='-', help='JSON lines report (default: stdout)')
+    parser.add_argument('--syntax', action='append', choices=sorted(default_grammar.syntaxes),
+                        help='tag syntax to recognize, can be repeated (default: %s)'
+                             % ', '.join(default_grammar.enabled))
+    args = parser.parse_args(argv)
+    if args.output == '-':
+        failed = run(args.files, sys.stdout, args.jobs, args.chunk_size, args.syntax)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as out:
+            failed = run(args.files, out, args.jobs, args.chunk_size, args.syntax)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
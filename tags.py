@@ -0,0 +1,164 @@
+"""
+The inline tag grammar shared by the editor, the serializer and the headless tools.
+
+A segment is modelled as a string in which tags are written as {n> (start),
+<n} (end) and {n} (empty). This module does not depend on Qt.
+
+Which placeholder conventions are recognized as tags is configured through a
+TagGrammar, a registry of TagSyntaxes. The enabled syntaxes are compiled into
+one pattern with a named group per syntax and tag kind, so that a single scan
+yields the span, kind and name of every tag. default_grammar is the grammar
+used by the editor and the tools; it has the numeric and formatting syntaxes
+enabled.
+
+"""
+
+
+from enum import Enum, auto
+import re
+
+
+class TagKind(Enum):
+    START = auto()
+    END = auto()
+    EMPTY = auto()
+
+
+class TagSyntax:
+    """A placeholder convention.
+
+    start, end and empty are regular expressions for the tags of each kind,
+    each with a group named 'name' that captures the tag name. If literal is
+    True the whole placeholder is used as the tag name, and written back as is.
+
+    """
+    __slots__ = ('name', 'patterns', 'literal')
+
+    def __init__(self, name, start=None, end=None, empty=None, literal=False):
+        self.name = name
+        self.patterns = {kind: pattern for kind, pattern in
+                         ((TagKind.START, start), (TagKind.END, end), (TagKind.EMPTY, empty)) if pattern}
+        self.literal = literal
+
+
+NUMERIC = TagSyntax('numeric', start=r'\{(?P<name>\d{1,2})>', end=r'<(?P<name>\d{1,2})\}',
+                    empty=r'\{(?P<name>\d{1,2})\}')
+FORMATTING = TagSyntax('formatting', start=r'\{(?P<name>[biu_^]+)>', end=r'<(?P<name>[biu_^]+)\}',
+                       empty=r'\{(?P<name>j)\}')
+NAMED = TagSyntax('named', start=r'\{(?P<name>[A-Za-z_][\w-]*)>', end=r'<(?P<name>[A-Za-z_][\w-]*)\}',
+                  empty=r'\{(?P<name>[A-Za-z_][\w-]*)\}')
+PRINTF = TagSyntax('printf', empty=r'(?<!%)(?P<name>%(?:\d+\$|\([A-Za-z_]\w*\))?[-+ 0#]*(?:\d+|\*)?(?:\.\d+)?'
+                                   r'(?:hh|h|ll|l|L|q|j|z|t)?[diouxXeEfFgGaAcsp@])', literal=True)
+ICU = TagSyntax('icu', empty=r'(?P<name>\{[A-Za-z_][\w.]*\})', literal=True)
+
+
+class TagGrammar:
+    """A registry of tag syntaxes, compiled into one pattern over the enabled ones."""
+
+    def __init__(self, syntaxes=(), enabled=None):
+        self.syntaxes = {}
+        self.enabled = []
+        self._pattern = None
+        self._groups = {}
+        self._literals = []
+        for syntax in syntaxes:
+            self.register(syntax, enabled is None or syntax.name in enabled)
+
+    def register(self, syntax, enabled=True):
+        self.syntaxes[syntax.name] = syntax
+        if enabled and syntax.name not in self.enabled:
+            self.enabled.append(syntax.name)
+        self._pattern = None
+
+    def enable(self, name):
+        if name not in self.syntaxes:
+            raise KeyError(name)
+        if name not in self.enabled:
+            self.enabled.append(name)
+            self._pattern = None
+
+    def disable(self, name):
+        if name in self.enabled:
+            self.enabled.remove(name)
+            self._pattern = None
+
+    def set_enabled(self, names):
+        """Enable exactly the named syntaxes, in the given order of precedence."""
+        for name in names:
+            if name not in self.syntaxes:
+                raise KeyError(name)
+        self.enabled = list(names)
+        self._pattern = None
+
+    @property
+    def pattern(self):
+        if self._pattern is None:
+            self.compile()
+        return self._pattern
+
+    def compile(self):
+        alternatives = []
+        groups = {}
+        literals = []
+        for index, name in enumerate(self.enabled):
+            syntax = self.syntaxes[name]
+            for kind, pattern in syntax.patterns.items():
+                group = f'_{index}_{kind.name}'
+                alternatives.append(f'(?P<{group}>{pattern.replace("(?P<name>", f"(?P<{group}_name>")})')
+                groups[group] = (kind, f'{group}_name')
+                if syntax.literal:
+                    literals.append(re.compile(pattern))
+        self._groups = groups
+        self._literals = literals
+        # an empty alternation would match everywhere, so use a pattern that never matches
+        self._pattern = re.compile('|'.join(alternatives) if alternatives else r'(?!)')
+
+    def scan(self, text, pos=0, endpos=None):
+        """Yield ((start, end), kind, name) for each tag in text."""
+        pattern = self.pattern
+        groups = self._groups
+        matches = pattern.finditer(text, pos) if endpos is None else pattern.finditer(text, pos, endpos)
+        for match in matches:
+            kind, name_group = groups[match.lastgroup]
+            yield match.span(), kind, match.group(name_group)
+
+    def parse(self, token):
+        """Return the (name, kind) of a tag written as token, or None if it is not a tag."""
+        match = self.pattern.fullmatch(token)
+        if match is None:
+            return None
+        kind, name_group = self._groups[match.lastgroup]
+        return match.group(name_group), kind
+
+    def stringify(self, name, kind):
+        """Return the model string form of a tag, the inverse of parse()."""
+        if kind == TagKind.START:
+            return f'{{{name}>'
+        if kind == TagKind.END:
+            return f'<{name}}}'
+        if self._pattern is None:
+            self.compile()
+        if isinstance(name, str):
+            for literal in self._literals:
+                if literal.fullmatch(name):
+                    return name
+        return f'{{{name}}}'
+
+
+default_grammar = TagGrammar((NUMERIC, FORMATTING, NAMED, PRINTF, ICU), enabled=('numeric', 'formatting'))
+
+
+def parse_tag(matched_str: str):
+    """Return the name and kind of a tag of the default grammar."""
+    return default_grammar.parse(matched_str)
+
+
+def iter_tags(data: str):
+    """Yield (start, end, name, kind) for each tag in the model string data."""
+    for (start, end), kind, name in default_grammar.scan(data):
+        yield start, end, name, kind
+
+
+def stringify_tag(name: str, kind: TagKind) -> str:
+    """Return the model string form of a tag, the inverse of parse_tag()."""
+    return default_grammar.stringify(name, kind)
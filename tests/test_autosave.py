@@ -0,0 +1,67 @@
+from autosave import Journal, read_journal
+
+
+def test_append_after_a_torn_record(tmp_path):
+    path = str(tmp_path / 'journal')
+    journal = Journal(path)
+    journal.append([('a', 'first'), ('b', 'second')])
+    journal.close()
+    with open(path, 'rb+') as f:
+        f.truncate(f.seek(0, 2) - 5)
+
+    journal = Journal(path)
+    assert journal.entries == {'a': 'first'}
+    journal.append([('c', 'third')])
+    journal.close()
+    entries, records = read_journal(path)
+    assert entries == {'a': 'first', 'c': 'third'}
+    assert records == 2
+
+
+def test_torn_first_record(tmp_path):
+    path = tmp_path / 'journal'
+    path.write_bytes(b'{"key": "a", "da')
+    journal = Journal(str(path))
+    journal.append([('b', 'second')])
+    journal.close()
+    assert read_journal(str(path)) == ({'b': 'second'}, 1)
+
+
+class Editor:
+    def __init__(self, data):
+        self.data = data
+
+    def to_model_data(self):
+        return self.data
+
+
+def test_slow_snapshot_is_forced_after_max_deferral(qapp, tmp_path, monkeypatch):
+    import autosave
+    clock = [100.0]
+    monkeypatch.setattr(autosave.time, 'monotonic', lambda: clock[0])
+    saver = autosave.AutoSaver(str(tmp_path / 'journal'))
+    saver.snapshot_costs['slow'] = 1.0
+    try:
+        def type_in(seconds):
+            clock[0] += seconds
+            saver.dirty['fast'] = Editor('fast')
+            saver.dirty['slow'] = Editor('slow')
+            saver.schedule()
+
+        type_in(0)
+        for _ in range(30):
+            type_in(0.1)
+        saver.on_timeout()
+        assert list(saver.dirty) == ['slow']
+        # the next keystroke does not flush at once
+        type_in(0.1)
+        assert saver.timer.interval() > 0
+        while clock[0] < 100.0 + saver.max_deferral_ms / 1000:
+            type_in(0.1)
+            if saver.timer.interval() == 0:
+                saver.on_timeout()
+        assert saver.dirty == {}
+        assert saver.deferred_since is None
+    finally:
+        saver.close()
+    assert autosave.read_journal(str(tmp_path / 'journal'))[0] == {'fast': 'fast', 'slow': 'slow'}
@@ -0,0 +1,42 @@
+from PyQt5.QtCore import QEvent, Qt
+from PyQt5.QtGui import QKeyEvent
+from PyQt5.QtWidgets import QApplication
+
+import latency
+
+
+def process_events(qapp):
+    for _ in range(5):
+        qapp.processEvents()
+
+
+def test_key_without_paint_finishes_its_event(qapp):
+    monitor = latency.enable()
+    try:
+        monitor.begin_event()
+        process_events(qapp)
+        assert monitor.event_start is None
+        assert monitor.events == 1
+    finally:
+        latency.disable()
+
+
+def test_key_with_paint_finishes_its_event_after_the_paint(qapp):
+    from main import TagTextEdit
+    editor = TagTextEdit()
+    editor.show()
+    process_events(qapp)
+    monitor = latency.enable()
+    samples = []
+    add_sample = monitor.add_sample
+    monitor.add_sample = lambda stage, seconds: (samples.append(stage), add_sample(stage, seconds))
+    try:
+        monitor.begin_event()
+        QApplication.sendEvent(editor, QKeyEvent(QEvent.KeyPress, Qt.Key_A, Qt.NoModifier, 'a'))
+        process_events(qapp)
+        assert monitor.events == 1
+        # the paint is a stage of the event, not a sample of its own after it
+        assert latency.PAINT in samples and samples[-1] == latency.TOTAL
+    finally:
+        latency.disable()
+        editor.close()
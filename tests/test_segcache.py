@@ -0,0 +1,57 @@
+import itertools
+import threading
+
+import segcache
+from xliff import XliffSegment
+
+
+def test_cache_of_another_version_is_rebuilt(tmp_path, monkeypatch):
+    path = tmp_path / 'file.xlf'
+    path.write_text('<xliff/>', encoding='utf-8')
+    cache_path = str(tmp_path / 'cache')
+    segcache.write_cache(cache_path, str(path), [XliffSegment('1', 'a {1}', 'b {1}')])
+    assert segcache.open_cache(str(path), cache_path)[0].target == 'b {1}'
+    monkeypatch.setattr(segcache, 'VERSION', segcache.VERSION + 1)
+    assert segcache.open_cache(str(path), cache_path) is None
+
+
+def write_xliff_file(path, count):
+    units = ''.join(f'<trans-unit id="{n}"><source>s{n} <x id="1"/></source><target>t{n}</target></trans-unit>'
+                    for n in range(count))
+    path.write_text('<xliff xmlns="urn:oasis:names:tc:xliff:document:1.2" version="1.2"><file><body>'
+                    f'{units}</body></file></xliff>', encoding='utf-8')
+
+
+def join_writer():
+    for thread in threading.enumerate():
+        if thread.name == 'segcache':
+            thread.join(10)
+            assert not thread.is_alive()
+
+
+def test_read_and_cache_writes_the_segments_as_parsed(tmp_path):
+    path = tmp_path / 'file.xlf'
+    write_xliff_file(path, 3000)
+    cache_path = str(tmp_path / 'cache')
+    segments = []
+    for segment in segcache.read_and_cache(str(path), cache_path):
+        segments.append(segment)
+        segment.target = 'edited'
+    join_writer()
+    cached = segcache.open_cache(str(path), cache_path)
+    assert len(cached) == 3000
+    assert [(segment.key, segment.source, segment.target) for segment in cached[::1000]] == [
+        ('0', 's0 {1}', 't0'), ('1000', 's1000 {1}', 't1000'), ('2000', 's2000 {1}', 't2000')]
+
+
+def test_read_and_cache_writes_no_cache_if_not_all_segments_are_read(tmp_path):
+    path = tmp_path / 'file.xlf'
+    write_xliff_file(path, 3000)
+    cache_path = tmp_path / 'cache'
+    segments = segcache.read_and_cache(str(path), str(cache_path))
+    for segment in itertools.islice(segments, 2000):
+        pass
+    segments.close()
+    join_writer()
+    assert not cache_path.exists()
+    assert list(tmp_path.iterdir()) == [path]
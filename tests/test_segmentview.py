@@ -0,0 +1,44 @@
+from segmentview import SegmentModel, SegmentView
+from xliff import XliffSegment
+
+
+def make_view(qapp, rows=6):
+    segments = [XliffSegment(str(row), f'source {row}', f'row {row}') for row in range(rows)]
+    view = SegmentView(SegmentModel(segments))
+    view.resize(800, 600)
+    view.show()
+    qapp.processEvents()
+    return view
+
+
+def test_switching_rows_completes_a_running_paste(qapp):
+    view = make_view(qapp)
+    model = view.model()
+    view.setCurrentIndex(view.target_index(3))
+    editor = view.indexWidget(view.target_index(3))
+    pasted = 'word {1}word ' * 8000
+    cursor = editor.textCursor()
+    cursor.movePosition(cursor.End)
+    editor.setTextCursor(cursor)
+    job = editor.paste_text(pasted)
+    assert job is not None and editor.clipboard_job is job
+    view.setCurrentIndex(view.target_index(4))
+    for _ in range(100):
+        qapp.processEvents()
+    assert model.segments[3].target == 'row 3' + pasted
+    assert model.segments[4].target == 'row 4'
+    editor = view.indexWidget(view.target_index(4))
+    assert editor.clipboard_job is None
+    assert editor.to_model_data() == 'row 4'
+
+
+def test_replacing_the_document_aborts_a_running_paste(qapp):
+    view = make_view(qapp)
+    view.setCurrentIndex(view.target_index(0))
+    editor = view.indexWidget(view.target_index(0))
+    editor.paste_text('x' * 100000)
+    editor.from_model_data('new')
+    for _ in range(100):
+        qapp.processEvents()
+    assert editor.clipboard_job is None
+    assert editor.to_model_data() == 'new'
@@ -0,0 +1,32 @@
+import io
+import json
+
+import pytest
+
+import tagqa
+
+GOOD = '''<?xml version="1.0" encoding="utf-8"?>
+<xliff xmlns="urn:oasis:names:tc:xliff:document:1.2" version="1.2"><file><body>
+<trans-unit id="1"><source>a <g id="1">b</g></source><target>A B</target></trans-unit>
+<trans-unit id="2"><source>c</source><target>C</target></trans-unit>
+</body></file></xliff>
+'''
+
+
+@pytest.mark.parametrize('jobs', [1, 8])
+def test_bad_file_does_not_stop_the_batch(tmp_path, jobs):
+    good = tmp_path / 'good.xlf'
+    good.write_text(GOOD, encoding='utf-8')
+    broken = tmp_path / 'broken.xlf'
+    broken.write_text(GOOD.replace('<g id="1">b</g>', 'b').replace('</target></trans-unit>\n</body>', '</tar'),
+                      encoding='utf-8')
+    missing = tmp_path / 'missing.xlf'
+    paths = [str(broken), str(missing), str(good)]
+    out = io.StringIO()
+    failed = tagqa.run(paths, out, jobs=jobs, chunk_size=1)
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [record['file'] for record in records if 'error' in record] == [str(broken), str(missing)]
+    summaries = {record['file']: record['summary'] for record in records if 'summary' in record}
+    assert summaries[str(good)] == {'segments': 2, 'failed': 1}
+    assert set(summaries) == set(paths)
+    assert failed == 3
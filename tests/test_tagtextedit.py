@@ -0,0 +1,38 @@
+import pytest
+from PyQt5.QtGui import QTextCursor
+
+from main import TAG_SCAN_MARGIN, TagTextEdit
+
+NAME = 'biu' * 8
+
+
+def type_text(editor, position, text):
+    cursor = QTextCursor(editor.document())
+    cursor.setPosition(position)
+    cursor.insertText(text)
+    editor.recognize_tags()
+
+
+@pytest.mark.parametrize('before, typed, after', [
+    ('x ', '{', NAME + '> y'),
+    ('x {' + NAME, '>', ' y'),
+    ('x <' + NAME, '}', ' y'),
+])
+def test_tag_with_a_long_name_is_recognized(qapp, before, typed, after):
+    assert len(NAME) > TAG_SCAN_MARGIN
+    editor = TagTextEdit()
+    editor.from_model_data(before + after)
+    type_text(editor, len(before), typed)
+    assert editor.toPlainText() == 'x \ufffc y'
+    assert editor.to_model_data() == before + typed + after
+
+
+def test_adjacent_identical_tags_are_walked_one_by_one(qapp):
+    from segment import Segment
+    from tags import TagKind
+    editor = TagTextEdit()
+    tags = [(1, '1', TagKind.EMPTY, 'tip'), (1, '1', TagKind.EMPTY, 'tip'), (2, '2', TagKind.EMPTY, 'other')]
+    editor.from_segment(Segment('ab\nc', tags))
+    assert list(editor.to_segment().tags()) == tags
+    assert editor.block_tags(editor.document().begin()) == [(1, '1', TagKind.EMPTY), (2, '1', TagKind.EMPTY),
+                                                            (4, '2', TagKind.EMPTY)]
@@ -0,0 +1,65 @@
+import xml.etree.ElementTree as ET
+
+from xliff import read_xliff, write_xliff
+
+XLIFF12 = '''<?xml version="1.0" encoding="utf-8"?>
+<xliff xmlns="urn:oasis:names:tc:xliff:document:1.2" version="1.2">
+<file original="test" source-language="en" target-language="de" datatype="plaintext"><body>
+<trans-unit id="1"><source>{source}</source><target>{target}</target></trans-unit>
+</body></file>
+</xliff>
+'''
+
+
+def round_trip(tmp_path, source, target):
+    path = tmp_path / 'in.xlf'
+    path.write_text(XLIFF12.format(source=source, target=target), encoding='utf-8')
+    segments = list(read_xliff(str(path)))
+    out = tmp_path / 'out.xlf'
+    write_xliff(str(path), str(out), segments)
+    return segments, list(read_xliff(str(out))), ET.parse(str(out))
+
+
+def test_text_that_reads_as_a_tag_is_kept_as_text(tmp_path):
+    segments, written, tree = round_trip(tmp_path, 'Use {1} or {b>bold&lt;b}',
+                                          'Nimm {1} oder <x id="7"/>{b>fett&lt;b}')
+    segment = segments[0]
+    # the literal text is protected as a tag, not taken for the tag of an element
+    assert segment.source == 'Use {1} or {2}bold{3}'
+    assert segment.target == 'Nimm {1} oder {4}{2}fett{3}'
+    assert 'Nimm {1} oder ' in ''.join(tree.getroot().itertext())
+    assert '{b>fett<b}' in ''.join(tree.getroot().itertext())
+    assert len(tree.findall('.//{urn:oasis:names:tc:xliff:document:1.2}x')) == 1
+    assert [(s.source, s.target) for s in written] == [(segment.source, segment.target)]
+
+
+def test_ph_content_is_written_back(tmp_path):
+    segments, written, tree = round_trip(tmp_path, 'a<ph id="1">&lt;br/&gt;</ph>b', 'A<ph id="1">&lt;br/&gt;</ph>B')
+    ph = tree.find('.//{urn:oasis:names:tc:xliff:document:1.2}target/{urn:oasis:names:tc:xliff:document:1.2}ph')
+    assert ph.get('id') == '1'
+    assert ph.text == '<br/>'
+    assert segments[0].target == 'A{1}B'
+    assert written[0].tags == segments[0].tags
+
+
+def test_unit_with_too_many_tags_is_skipped(tmp_path, caplog):
+    many = ''.join(f'<x id="{n}"/>' for n in range(100))
+    path = tmp_path / 'in.xlf'
+    path.write_text(XLIFF12.replace(
+        '<trans-unit id="1"><source>{source}</source><target>{target}</target></trans-unit>',
+        '<trans-unit id="1"><source>one</source></trans-unit>'
+        f'<trans-unit id="2"><source>{many}</source><target>old {many}</target></trans-unit>'
+        '<trans-unit id="3"><source>three</source></trans-unit>'), encoding='utf-8')
+    segments = list(read_xliff(str(path)))
+    assert [segment.key for segment in segments] == ['1', '3']
+    assert "'2'" in caplog.text
+    for segment in segments:
+        segment.target = segment.source.upper()
+    out = tmp_path / 'out.xlf'
+    write_xliff(str(path), str(out), segments)
+    tree = ET.parse(str(out))
+    ns = '{urn:oasis:names:tc:xliff:document:1.2}'
+    targets = {unit.get('id'): unit.find(ns + 'target') for unit in tree.iter(ns + 'trans-unit')}
+    assert targets['1'].text == 'ONE'
+    assert targets['2'].text == 'old ' and len(targets['2']) == 100
+    assert targets['3'].text == 'THREE'
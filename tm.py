@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+A local translation memory with fuzzy, tag-aware lookup.
+
+Entries are pairs of model strings, the format of TagTextEdit.to_model_data().
+They are keyed on their tag-neutral text, the source without its tags, so a
+previous translation is found whatever tags the current segment has.
+
+A memory is built once into an index file and opened with mmap, so opening
+it does not read the file. For each entry the file has its source, target and
+key; an inverted index maps the hash of every character trigram of the keys
+to the sorted ids of the entries containing it. A lookup counts the trigrams
+each entry shares with the query, starting with the rarest ones and stopping
+after postings_budget postings, shortlists the entries sharing the most, and
+scores those by edit distance. The tags of a matched target are then renamed
+to the tags of the query, in order of appearance, and tags the query does not
+have are dropped.
+
+Entries added with add() are kept in memory and searched along with the file
+until save() writes a new index.
+
+usage: tm.py build INDEX FILE...
+       tm.py lookup INDEX SEGMENT...
+
+"""
+
+
+import argparse
+import array
+import collections
+import heapq
+import mmap
+import operator
+import os
+import struct
+import sys
+import zlib
+
+from segment import Segment
+from tags import TagKind, default_grammar
+
+MAGIC = b'TETM'
+VERSION = 1
+GRAM_SIZE = 3
+
+# magic, version, byte order (0 little, 1 big), entries, grams, postings, blob size
+_HEADER = struct.Struct('<4sBB2xQQQQ')
+_HEADER_SIZE = 64
+
+
+class TmMatch:
+    """A translation memory match.
+
+    score is the similarity of the query and the matched source, between 0 and
+    1. source and target are the stored model strings, and translation is the
+    target with its tags renamed to those of the query.
+
+    """
+    __slots__ = ('score', 'source', 'target', 'translation')
+
+    def __init__(self, score, source, target, translation):
+        self.score = score
+        self.source = source
+        self.target = target
+        self.translation = translation
+
+    def __repr__(self):
+        return f'TmMatch({self.score:.2f}, {self.source!r}, {self.translation!r})'
+
+
+def tm_key(data):
+    """Return the tag-neutral text of the model string data."""
+    return Segment.from_model(data).text
+
+
+def grams(text):
+    """Return the set of hashes of the character trigrams of text.
+
+    Texts shorter than a trigram are a gram of their own. The hashes are
+    stable between processes, unlike hash().
+
+    """
+    if len(text) < GRAM_SIZE:
+        return {zlib.crc32(text.encode('utf-8'))} if text else set()
+    return {zlib.crc32(text[i:i + GRAM_SIZE].encode('utf-8')) for i in range(len(text) - GRAM_SIZE + 1)}
+
+
+def edit_distance(a, b, limit):
+    """Return the Levenshtein distance of a and b, or limit + 1 if it is larger than limit.
+
+    Only the diagonal band of width 2 * limit + 1 is computed.
+
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    if len(a) > len(b):
+        a, b = b, a
+    too_far = limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        low = max(1, i - limit)
+        high = min(len(b), i + limit)
+        current = [too_far] * (len(b) + 1)
+        if low == 1:
+            current[0] = i
+        best = current[0]
+        for j in range(low, high + 1):
+            cost = previous[j - 1] + (char != b[j - 1])
+            if previous[j] + 1 < cost:
+                cost = previous[j] + 1
+            if current[j - 1] + 1 < cost:
+                cost = current[j - 1] + 1
+            current[j] = cost
+            if cost < best:
+                best = cost
+        if best > limit:
+            return too_far
+        previous = current
+    return min(previous[len(b)], too_far)
+
+
+def _tag_names(data):
+    """Return the names of the paired and of the empty tags of data in order of appearance."""
+    paired = {}
+    empty = {}
+    for span, kind, name in default_grammar.scan(data):
+        (empty if kind == TagKind.EMPTY else paired).setdefault(name, None)
+    return list(paired), list(empty)
+
+
+def remap_tags(source, target, query):
+    """Return target with the tags of source renamed to those of query.
+
+    The tags are matched in order of appearance, paired and empty tags
+    separately. Tags of target without a counterpart in query are dropped.
+
+    """
+    source_paired, source_empty = _tag_names(source)
+    query_paired, query_empty = _tag_names(query)
+    paired = dict(zip(source_paired, query_paired))
+    empty = dict(zip(source_empty, query_empty))
+    parts = []
+    pos = 0
+    for (start, end), kind, name in default_grammar.scan(target):
+        parts.append(target[pos:start])
+        pos = end
+        new_name = (empty if kind == TagKind.EMPTY else paired).get(name)
+        if new_name is not None:
+            parts.append(default_grammar.stringify(new_name, kind))
+    if not parts:
+        return target
+    parts.append(target[pos:])
+    return ''.join(parts)
+
+
+def _tag_count(data):
+    return sum(1 for tag in default_grammar.scan(data))
+
+
+def build(path, entries):
+    """Write an index of the (source, target) model string pairs in entries to path.
+
+    Of entries with the same key, the last one is kept.
+
+    """
+    unique = {}
+    for source, target in entries:
+        key = tm_key(source)
+        if key:
+            unique.pop(key, None)
+            unique[key] = (source, target)
+    postings = collections.defaultdict(lambda: array.array('I'))
+    blob = bytearray()
+    offsets = array.array('Q', [0])
+    lengths = array.array('I')
+    for entry_id, (key, (source, target)) in enumerate(unique.items()):
+        for gram in grams(key):
+            postings[gram].append(entry_id)
+        for text in (source, target, key):
+            blob += text.encode('utf-8')
+            offsets.append(len(blob))
+        lengths.append(len(key))
+    gram_hashes = array.array('I', sorted(postings))
+    gram_offsets = array.array('Q', [0])
+    posting_ids = array.array('I')
+    for gram in gram_hashes:
+        posting_ids.extend(postings[gram])
+        gram_offsets.append(len(posting_ids))
+    header = _HEADER.pack(MAGIC, VERSION, sys.byteorder == 'big', len(unique), len(gram_hashes), len(posting_ids),
+                          len(blob))
+    with open(path, 'wb') as f:
+        f.write(header.ljust(_HEADER_SIZE, b'\0'))
+        # the 8 byte arrays first, so that every array is aligned
+        for section in (offsets, gram_offsets, gram_hashes, posting_ids, lengths):
+            section.tofile(f)
+        f.write(blob)
+
+
+class TranslationMemory:
+    """A translation memory index, opened with mmap.
+
+    If path is None, the memory starts empty and only holds the entries that
+    are added to it.
+
+    """
+    shortlist = 20
+    postings_budget = 100000
+    tag_penalty = 0.01
+
+    def __init__(self, path=None):
+        self.path = path
+        self.file = None
+        self.map = None
+        self.count = 0
+        self.added = {}
+        self.added_postings = collections.defaultdict(set)
+        if path is not None:
+            self.open(path)
+
+    def open(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, big_endian, count, gram_count, posting_count, blob_size = _HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{path} is not a translation memory index')
+        if big_endian != (sys.byteorder == 'big'):
+            self.close()
+            raise ValueError(f'{path} was written on a machine with a different byte order')
+        view = memoryview(self.map)
+        pos = _HEADER_SIZE
+
+        def section(typecode, size, length):
+            nonlocal pos
+            start = pos
+            pos += size * length
+            return view[start:pos].cast(typecode)
+        self.offsets = section('Q', 8, 3 * count + 1)
+        self.gram_offsets = section('Q', 8, gram_count + 1)
+        self.gram_hashes = section('I', 4, gram_count)
+        self.postings = section('I', 4, posting_count)
+        self.lengths = section('I', 4, count)
+        self.blob = view[pos:pos + blob_size]
+        self.count = count
+
+    def close(self):
+        if self.map is not None:
+            for name in ('offsets', 'gram_offsets', 'gram_hashes', 'postings', 'lengths', 'blob'):
+                view = self.__dict__.pop(name, None)
+                if view is not None:
+                    view.release()
+            self.map.close()
+            self.map = None
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.count + len(self.added)
+
+    def _text(self, index):
+        return str(self.blob[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+    def entry(self, entry_id):
+        """Return the (source, target, key) of a stored entry."""
+        return self._text(3 * entry_id), self._text(3 * entry_id + 1), self._text(3 * entry_id + 2)
+
+    def entries(self):
+        """Yield the (source, target) pairs of the memory, the added ones last."""
+        added = self.added
+        for entry_id in range(self.count):
+            source, target, key = self.entry(entry_id)
+            if key not in added:
+                yield source, target
+        yield from added.values()
+
+    def add(self, source, target):
+        """Add a translation, replacing the one with the same key."""
+        key = tm_key(source)
+        if not key:
+            return
+        self.added.pop(key, None)
+        self.added[key] = (source, target)
+        for gram in grams(key):
+            self.added_postings[gram].add(key)
+
+    def save(self, path=None):
+        """Write the memory with the added entries to path and reopen it from there."""
+        path = path or self.path
+        temporary = path + '.tmp'
+        build(temporary, self.entries())
+        self.close()
+        os.replace(temporary, path)
+        self.path = path
+        self.added.clear()
+        self.added_postings.clear()
+        self.open(path)
+
+    def _postings(self, gram):
+        i = _bisect(self.gram_hashes, gram)
+        if i < len(self.gram_hashes) and self.gram_hashes[i] == gram:
+            return self.postings[self.gram_offsets[i]:self.gram_offsets[i + 1]]
+        return None
+
+    def candidates(self, key, minimum):
+        """Return the ids and keys of the entries sharing the most trigrams with key."""
+        length = len(key)
+        found = []
+        query_grams = grams(key)
+        if self.count:
+            lists = [postings for postings in map(self._postings, query_grams) if postings is not None]
+            lists.sort(key=len)
+            counts = collections.Counter()
+            budget = self.postings_budget
+            for postings in lists:
+                if len(postings) > budget:
+                    if not counts:
+                        # even the rarest trigram is too common, count its most recent entries
+                        counts.update(postings[-budget:].tolist())
+                    break
+                counts.update(postings.tolist())
+                budget -= len(postings)
+            lengths = self.lengths
+            for entry_id, count in heapq.nlargest(self.shortlist * 2, counts.items(), key=operator.itemgetter(1)):
+                if _comparable(length, lengths[entry_id], minimum):
+                    found.append((count, entry_id))
+        if self.added:
+            counts = collections.Counter()
+            for gram in query_grams:
+                counts.update(self.added_postings.get(gram, ()))
+            for added_key, count in counts.items():
+                if _comparable(length, len(added_key), minimum):
+                    found.append((count, added_key))
+        found.sort(key=operator.itemgetter(0), reverse=True)
+        return [entry for count, entry in found[:self.shortlist]]
+
+    def lookup(self, data, limit=5, minimum=0.7):
+        """Return up to limit TmMatches for the model string data, best first.
+
+        Matches scoring less than minimum are left out.
+
+        """
+        key = tm_key(data)
+        if not key:
+            return []
+        query_tags = _tag_count(data)
+        matches = []
+        for entry in self.candidates(key, minimum):
+            if isinstance(entry, str):
+                source, target = self.added[entry]
+                entry_key = entry
+            else:
+                source, target, entry_key = self.entry(entry)
+                if entry_key in self.added:
+                    continue
+            longest = max(len(key), len(entry_key))
+            limit_distance = int((1 - minimum) * longest)
+            distance = edit_distance(key, entry_key, limit_distance)
+            if distance > limit_distance:
+                continue
+            score = 1 - distance / longest - self.tag_penalty * abs(query_tags - _tag_count(source))
+            if score >= minimum:
+                matches.append(TmMatch(score, source, target, remap_tags(source, target, data)))
+        matches.sort(key=operator.attrgetter('score'), reverse=True)
+        return matches[:limit]
+
+
+def _comparable(length, other, minimum):
+    # texts whose lengths differ this much cannot score minimum
+    return min(length, other) >= minimum * max(length, other)
+
+
+def _bisect(values, value):
+    # bisect.bisect_left() for a memoryview
+    low, high = 0, len(values)
+    while low < high:
+        middle = (low + high) // 2
+        if values[middle] < value:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Build or query a translation memory index.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    build_parser = commands.add_parser('build', help='build an index from the translated segments of XLIFF files')
+    build_parser.add_argument('index')
+    build_parser.add_argument('files', nargs='+', metavar='FILE')
+    lookup_parser = commands.add_parser('lookup', help='look up model strings')
+    lookup_parser.add_argument('index')
+    lookup_parser.add_argument('segments', nargs='+', metavar='SEGMENT')
+    lookup_parser.add_argument('--minimum', type=float, default=0.7, help='the lowest score to report')
+    options = parser.parse_args(argv)
+
+    if options.command == 'build':
+        from xliff import read_xliff
+        build(options.index, ((segment.source, segment.target) for path in options.files
+                              for segment in read_xliff(path) if segment.target))
+        return 0
+    with TranslationMemory(options.index) as memory:
+        for data in options.segments:
+            for match in memory.lookup(data, minimum=options.minimum):
+                print(f'{match.score:.2f}\t{match.source}\t{match.translation}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -23,6 +23,16 @@ Provides custom word-boundary behaviour for QTextCursor and QTextEdit etc.
 You can inherit from BoundaryHandler to change the behaviour. You can just
 change the word_regexp expression, or override the boundaries() method.
 
+By default words are found without a regular expression search: each
+character is mapped to its class (hiragana, katakana, the prolonged sound mark,
+CJK ideograph, ASCII letter or digit, whitespace, tag object or other) through
+a table over the Basic Multilingual Plane, and runs of the same class are
+grouped in one pass. This gives the same words as word_regexp, which is still
+used if a subclass changes it. A tag (U+FFFC) is always a word of its own.
+
+The word boundaries of recently used blocks are cached, keyed on the text of
+the block, so repeated word moves within a block do not rescan its text.
+
 Install a BoundaryHandler as eventfilter on a QTextEdit or QPlainTextEdit.
 If you also want the double-click word selection to work, install the handler
 also as eventfilter on the textedit's viewport(). The install_textedit() and
@@ -37,8 +47,9 @@ many textedit widgets as you like.
 """
 
 
-import itertools
-import operator
+import array
+import bisect
+import collections
 import re
 import time
 
@@ -47,6 +58,41 @@ from PyQt5.QtGui import QKeySequence, QTextCursor
 from PyQt5.QtWidgets import QApplication
 
 
+# one letter per class, the prolonged sound mark joins both hiragana and katakana runs
+_HIRAGANA, _KATAKANA, _PROLONGED, _HAN, _ALNUM, _SPACE, _OBJECT, _OTHER = 'HKPNASTO'
+_class_runs = re.compile(r'[HP]+|[KP]+|N+|A+|[^S]')
+_class_table = None
+
+
+def char_class_table():
+    """Return the class of each BMP code point as a string, for use with str.translate()."""
+    global _class_table
+    if _class_table is None:
+        table = bytearray(_OTHER.encode() * 0x10000)
+        for code in range(0x10000):
+            if chr(code).isspace():
+                table[code] = ord(_SPACE)
+        table[0x3041:0x3094] = _HIRAGANA.encode() * (0x3094 - 0x3041)
+        table[0x30A1:0x30F4] = _KATAKANA.encode() * (0x30F4 - 0x30A1)
+        table[0x30FC] = ord(_PROLONGED)
+        table[0x4E00:0xA000] = _HAN.encode() * (0xA000 - 0x4E00)
+        for start, end in ((0x30, 0x3A), (0x41, 0x5B), (0x61, 0x7B)):
+            table[start:end] = _ALNUM.encode() * (end - start)
+        table[0xFFFC] = ord(_OBJECT)
+        _class_table = table.decode('ascii')
+    return _class_table
+
+
+def word_spans(text):
+    """Return the (start, end) spans of the words in text, skipping whitespace.
+
+    Characters outside the BMP are not in the table and are left unchanged by
+    the translation, so they become words of their own like other symbols.
+
+    """
+    return [m.span() for m in _class_runs.finditer(text.translate(char_class_table()))]
+
+
 _move_operations = (
     QTextCursor.StartOfWord,
     QTextCursor.PreviousWord,
@@ -62,6 +108,15 @@ class BoundaryHandler(QObject):
     _double_click_time = 0.0
     # word_regexp = re.compile(r'\\?\w+|^|$', re.UNICODE)
     word_regexp = re.compile(r'[ぁ-んー]+|[ァ-ンー]+|[\u4e00-\u9FFF]+|[a-zA-Z0-9]+|[^ぁ-んァ-ンー\u4e00-\u9FFFa-zA-Z0-9]')
+    cache_size = 256
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._cache = collections.OrderedDict()
+
+    def clear_cache(self):
+        """Forget all cached block boundaries."""
+        self._cache.clear()
 
     def boundaries(self, block):
         """Return a list of tuples specifying the position of words in the block.
@@ -70,18 +125,42 @@ class BoundaryHandler(QObject):
         specified block.
 
         You can return other boundaries by changing the word_regexp or by
-        inheriting from this class and overwriting this method.
+        inheriting from this class and overwriting this method. The result
+        is cached by the text of the block, so it must only depend on that.
+
+        """
+        if self.word_regexp is BoundaryHandler.word_regexp:
+            return word_spans(block.text())
+        return [m.span() for m in self.word_regexp.finditer(block.text()) if not m.group(0).isspace()]
+
+    def cached_boundaries(self, block):
+        """Return the sorted start and end positions of the words in the block.
+
+        The result of boundaries() is cached keyed on the text of the block,
+        which is all it depends on, so that a block can never get the words of
+        another block that took over its number. The least recently used
+        entries are evicted when more than cache_size blocks are cached.
 
         """
-        return [m.span() for m in self.word_regexp.finditer(block.text()) if not re.search(r'^\s+$', m.group(0))]
+        key = block.text()
+        cache = self._cache
+        entry = cache.get(key)
+        if entry is not None:
+            cache.move_to_end(key)
+            return entry
+        spans = self.boundaries(block)
+        starts = array.array('i', (start for start, end in spans))
+        ends = array.array('i', (end for start, end in spans))
+        cache[key] = (starts, ends)
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+        return starts, ends
 
     def left_boundaries(self, block):
-        left = operator.itemgetter(0)
-        return [left(b) for b in self.boundaries(block)]
+        return list(self.cached_boundaries(block)[0])
 
     def right_boundaries(self, block):
-        right = operator.itemgetter(1)
-        return [right(b) for b in self.boundaries(block)]
+        return list(self.cached_boundaries(block)[1])
 
     def move(self, cursor, operation, mode=QTextCursor.MoveAnchor, n=1):
         """Reimplements Word-related cursor operations:
@@ -99,45 +178,53 @@ class BoundaryHandler(QObject):
         pos = cursor.position() - block.position()
         if operation == QTextCursor.StartOfWord:
             if pos:
-                for start, end in reversed(self.boundaries(block)):
-                    if start < pos:
-                        if end < pos:
-                            return False
-                        cursor.setPosition(block.position() + start, mode)
-                        return True
-            return False
-        elif operation == QTextCursor.EndOfWord:
-            for start, end in self.boundaries(block):
-                if end > pos:
-                    if start > pos:
+                starts, ends = self.cached_boundaries(block)
+                # the last word starting before the cursor
+                i = bisect.bisect_left(starts, pos) - 1
+                if i >= 0:
+                    if ends[i] < pos:
                         return False
-                    cursor.setPosition(block.position() + end, mode)
+                    cursor.setPosition(block.position() + starts[i], mode)
                     return True
             return False
+        elif operation == QTextCursor.EndOfWord:
+            starts, ends = self.cached_boundaries(block)
+            # the first word ending after the cursor
+            i = bisect.bisect_right(ends, pos)
+            if i < len(ends):
+                if starts[i] > pos:
+                    return False
+                cursor.setPosition(block.position() + ends[i], mode)
+                return True
+            return False
         elif operation in (QTextCursor.PreviousWord, QTextCursor.WordLeft):
-            boundaries = list(itertools.takewhile(lambda b: b<pos, self.left_boundaries(block)))
+            starts = self.cached_boundaries(block)[0]
+            count = bisect.bisect_left(starts, pos)
             while True:
-                if len(boundaries) >= n:
-                    cursor.setPosition(block.position() + boundaries[-n], mode)
+                if count >= n:
+                    cursor.setPosition(block.position() + starts[count - n], mode)
                     return True
-                n -= len(boundaries)
+                n -= count
                 block = block.previous()
                 if not block.isValid():
                     cursor.setPosition(0, mode)
                     return False
-                boundaries = self.left_boundaries(block)
+                starts = self.cached_boundaries(block)[0]
+                count = len(starts)
         elif operation in (QTextCursor.NextWord, QTextCursor.WordRight):
-            boundaries = list(itertools.dropwhile(lambda b: b<=pos, self.left_boundaries(block)))
+            starts = self.cached_boundaries(block)[0]
+            i = bisect.bisect_right(starts, pos)
             while True:
-                if len(boundaries) >= n:
-                    cursor.setPosition(block.position() + boundaries[n-1], mode)
+                if len(starts) - i >= n:
+                    cursor.setPosition(block.position() + starts[i + n - 1], mode)
                     return True
-                n -= len(boundaries)
+                n -= len(starts) - i
                 block = block.next()
                 if not block.isValid():
                     cursor.movePosition(QTextCursor.End, mode)
                     return False
-                boundaries = self.left_boundaries(block)
+                starts = self.cached_boundaries(block)[0]
+                i = 0
         else:
             return cursor.movePosition(operation, mode, n)
 
@@ -0,0 +1,399 @@
+"""
+Streaming reader and writer for XLIFF 1.2 and 2.0 files.
+
+read_xliff() parses a file incrementally and yields one XliffSegment per
+trans-unit (1.2) or segment (2.0), discarding each unit once it has been
+yielded, so memory use does not grow with the size of the file. A unit with
+more distinct inline elements than there are two-digit tag names is skipped
+with a warning, and write_xliff() leaves it as it is.
+
+The source and target of a segment are model strings, the format produced by
+TagTextEdit.to_model_data(). Inline elements are mapped to numbered tags:
+<g>, <pc> and <mrk> become a {n> ... <n} pair, <bx> and <sc> a {n> start tag,
+<ex> and <ec> a <n} end tag, and <x>, <ph> and <it> a {n} empty tag. The
+original element of each tag, with the text content of <ph> and <it>, is kept
+in XliffSegment.tags so that write_xliff() can put it back. Text that would
+read as a tag of tags.default_grammar, such as a literal "{1}", becomes an
+empty tag as well, which is written back as the original text.
+
+write_xliff() copies a file event by event and replaces the targets with the
+ones of the given segments, without building the tree of either document.
+
+"""
+
+
+import logging
+import xml.etree.ElementTree as ET
+from xml.sax import make_parser
+from xml.sax.handler import feature_namespaces
+from xml.sax.saxutils import XMLFilterBase, XMLGenerator
+from xml.sax.xmlreader import AttributesNSImpl
+
+from tags import TagKind, default_grammar
+
+logger = logging.getLogger(__name__)
+
+XLIFF12_NS = 'urn:oasis:names:tc:xliff:document:1.2'
+XLIFF20_NS = 'urn:oasis:names:tc:xliff:document:2.0'
+
+_PAIRED = ('g', 'pc', 'mrk')
+_STARTS = ('bx', 'sc')
+_ENDS = ('ex', 'ec')
+_EMPTIES = ('x', 'ph', 'it')
+# the element name of the tags that stand for text that reads as a tag
+_TEXT = '#text'
+
+
+class XliffSegment:
+    """A translatable segment of an XLIFF file.
+
+    key identifies the segment within its file, source and target are model
+    strings (target is None if the segment has no target) and tags maps
+    (tag name, TagKind) to the (element name, attributes, text content) of the
+    inline element the tag was read from. The text content is None for
+    elements without one; for a tag that stands for text, the element name is
+    '#text' and the text content is that text.
+
+    """
+    __slots__ = ('key', 'source', 'target', 'tags')
+
+    def __init__(self, key, source, target=None, tags=None):
+        self.key = key
+        self.source = source
+        self.target = target
+        self.tags = {} if tags is None else tags
+
+    def __repr__(self):
+        return f'XliffSegment({self.key!r}, {self.source!r}, {self.target!r})'
+
+
+def _split_name(name):
+    # split a Clark notation name '{ns}local' into (ns, local)
+    if name[0] == '{':
+        ns, local = name[1:].split('}', 1)
+        return ns, local
+    return None, name
+
+
+_local_names = {}
+
+
+def _local_name(name):
+    local = _local_names.get(name)
+    if local is None:
+        local = _local_names[name] = _split_name(name)[1]
+    return local
+
+
+class _InlineReader:
+    """Converts the content of <source> and <target> elements of the unit key to model strings."""
+
+    def __init__(self, key):
+        self.key = key
+        self.names = {}
+        self.tags = {}
+        self.text = []
+
+    def tag_name(self, key, kind, local, attrib, content=None):
+        name = self.names.get(key)
+        if name is None:
+            name = str(len(self.names) + 1)
+            # the numeric tag syntax only has two digits for the name
+            if default_grammar.parse(f'{{{name}}}') is None:
+                raise ValueError(f'unit {self.key!r} has more inline tags than tag names, '
+                                 f'{len(self.names)} at most')
+            self.names[key] = name
+        self.tags.setdefault((name, kind), (local, dict(attrib), content))
+        return name
+
+    def to_model(self, elem):
+        parts = []
+        self.append_content(elem, parts)
+        self.flush_text(parts)
+        return ''.join(parts)
+
+    def flush_text(self, parts):
+        """Append the text collected since the last tag to parts, putting the text that reads as a tag in tags."""
+        # the text is collected first because text around an unknown element may read as a tag once joined
+        text = ''.join(self.text)
+        self.text.clear()
+        if default_grammar.pattern.search(text) is None:
+            parts.append(text)
+            return
+        pos = 0
+        for (start, end), kind, name in default_grammar.scan(text):
+            literal = text[start:end]
+            parts.append(text[pos:start])
+            parts.append(f'{{{self.tag_name(("text", literal), TagKind.EMPTY, _TEXT, {}, literal)}}}')
+            pos = end
+        parts.append(text[pos:])
+
+    def append_tag(self, parts, key, kind, local, attrib, content=None):
+        self.flush_text(parts)
+        name = self.tag_name(key, kind, local, attrib, content)
+        parts.append(f'{{{name}>' if kind == TagKind.START else f'<{name}}}' if kind == TagKind.END else f'{{{name}}}')
+
+    def append_content(self, elem, parts):
+        if elem.text:
+            self.text.append(elem.text)
+        for child in elem:
+            local = _local_name(child.tag)
+            attrib = child.attrib
+            if local in _PAIRED:
+                key = ('id', attrib.get('id'))
+                self.append_tag(parts, key, TagKind.START, local, attrib)
+                self.append_content(child, parts)
+                self.append_tag(parts, key, TagKind.END, local, attrib)
+            elif local in _STARTS:
+                key = ('id', attrib.get('rid', attrib.get('id')))
+                self.append_tag(parts, key, TagKind.START, local, attrib)
+            elif local in _ENDS:
+                key = ('id', attrib.get('rid', attrib.get('startRef', attrib.get('id'))))
+                self.append_tag(parts, key, TagKind.END, local, attrib)
+            elif local in _EMPTIES:
+                key = ('id', attrib.get('id'))
+                # the native code of a <ph> or <it>, such as &lt;br/&gt;
+                content = ''.join(child.itertext()) or None
+                self.append_tag(parts, key, TagKind.EMPTY, local, attrib, content)
+            else:
+                self.append_content(child, parts)
+            if child.tail:
+                self.text.append(child.tail)
+
+
+def read_xliff(source):
+    """Yield the XliffSegments of an XLIFF 1.2 or 2.0 file, in document order.
+
+    source is a file name or a binary file object.
+
+    """
+    stack = []
+    unit_id = None
+    segment_index = 0
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        local = _local_name(elem.tag)
+        if event == 'start':
+            stack.append(elem)
+            if local == 'unit':
+                unit_id = elem.get('id')
+                segment_index = 0
+            continue
+        stack.pop()
+        if local == 'unit':
+            # the segments are gone, drop the rest of the unit as well
+            unit_id = None
+            elem.clear()
+            if stack:
+                stack[-1].remove(elem)
+            continue
+        if local == 'trans-unit':
+            key = elem.get('id')
+        elif local == 'segment' and unit_id is not None:
+            segment_index += 1
+            key = f'{unit_id}/{elem.get("id", segment_index)}'
+        else:
+            continue
+        try:
+            segment = _read_unit(elem, key)
+        except ValueError as error:
+            logger.warning('skipped a unit of %s: %s', getattr(source, 'name', source), error)
+        else:
+            yield segment
+        # drop the unit so the partial tree does not grow with the file
+        elem.clear()
+        if stack:
+            stack[-1].remove(elem)
+
+
+def _read_unit(elem, key):
+    reader = _InlineReader(key)
+    source = target = None
+    for child in elem:
+        local = _local_name(child.tag)
+        if local == 'source':
+            source = reader.to_model(child)
+        elif local == 'target':
+            target = reader.to_model(child)
+    return XliffSegment(key, source if source is not None else '', target, reader.tags)
+
+
+def _pair_tags(tokens):
+    """Return a dict mapping the indexes of properly nested START and END tokens to each other."""
+    pairs = {}
+    stack = []
+    for i, (name, kind) in enumerate(tokens):
+        if kind == TagKind.START:
+            stack.append((name, i))
+        elif kind == TagKind.END:
+            if stack and stack[-1][0] == name:
+                start = stack.pop()[1]
+                pairs[start] = i
+                pairs[i] = start
+    return pairs
+
+
+class _XliffWriter(XMLFilterBase):
+    """Passes SAX events through, replacing the target of each unit with the edited one."""
+
+    def __init__(self, parent, segments):
+        super().__init__(parent)
+        self.segments = iter(segments)
+        self.next_segment = None
+        self.unit_id = None
+        self.unit_depth = None
+        self.depth = 0
+        self.segment = None
+        self.segment_index = 0
+        self.target_pending = False
+        self.skip_depth = None
+        self.ns = None
+
+    def startElementNS(self, name, qname, attrs):
+        self.depth += 1
+        if self.skip_depth is not None:
+            return
+        ns, local = name
+        if self.unit_depth is not None and self.depth == self.unit_depth + 1:
+            if local == 'target' and self.segment.target is not None:
+                self.target_pending = False
+                self.write_target(attrs)
+                self.skip_depth = self.depth
+                return
+            if self.target_pending and local != 'seg-source':
+                self.target_pending = False
+                self.write_target(None)
+        if local == 'unit':
+            self.unit_id = attrs.get((None, 'id'))
+            self.segment_index = 0
+        elif local == 'trans-unit' or (local == 'segment' and self.unit_id is not None):
+            self.ns = ns
+            self.unit_depth = self.depth
+            self.segment_index += 1
+            if local == 'trans-unit':
+                key = attrs.get((None, 'id'))
+            else:
+                key = f'{self.unit_id}/{attrs.get((None, "id"), self.segment_index)}'
+            if self.next_segment is None:
+                self.next_segment = next(self.segments, None)
+            if self.next_segment is not None and self.next_segment.key == key:
+                self.segment, self.next_segment = self.next_segment, None
+            else:
+                # a unit read_xliff() skipped keeps its target
+                self.segment = XliffSegment(key, '')
+        super().startElementNS(name, qname, attrs)
+
+    def endDocument(self):
+        segment = self.next_segment or next(self.segments, None)
+        if segment is not None:
+            raise ValueError(f'segment {segment.key!r} is not in the file, or not in document order')
+        super().endDocument()
+
+    def endElementNS(self, name, qname):
+        depth = self.depth
+        self.depth -= 1
+        if self.skip_depth is not None:
+            if depth == self.skip_depth:
+                self.skip_depth = None
+            return
+        if self.unit_depth is not None:
+            if depth == self.unit_depth + 1 and name[1] in ('source', 'seg-source'):
+                super().endElementNS(name, qname)
+                self.target_pending = self.segment.target is not None
+                return
+            if depth == self.unit_depth:
+                if self.target_pending:
+                    self.target_pending = False
+                    self.write_target(None)
+                self.unit_depth = None
+                self.segment = None
+        if name[1] == 'unit':
+            self.unit_id = None
+        super().endElementNS(name, qname)
+
+    def characters(self, content):
+        if self.skip_depth is None:
+            super().characters(content)
+
+    def ignorableWhitespace(self, whitespace):
+        if self.skip_depth is None:
+            super().ignorableWhitespace(whitespace)
+
+    def processingInstruction(self, target, data):
+        if self.skip_depth is None:
+            super().processingInstruction(target, data)
+
+    def write_element(self, local, attrib, empty=False):
+        attrs = {}
+        qnames = {}
+        for key, value in attrib.items():
+            ns, attr_local = _split_name(key)
+            attrs[(ns, attr_local)] = value
+            qnames[(ns, attr_local)] = attr_local
+        name = (self.ns, local)
+        super().startElementNS(name, local, AttributesNSImpl(attrs, qnames))
+        if empty:
+            super().endElementNS(name, local)
+
+    def write_target(self, attrs):
+        target_name = (self.ns, 'target')
+        super().startElementNS(target_name, 'target', attrs or AttributesNSImpl({}, {}))
+        data = self.segment.target
+        tags = self.segment.tags
+        matches = list(default_grammar.scan(data))
+        tokens = [(name, kind) for span, kind, name in matches]
+        elements = [tags.get(token, (None, {'id': token[0]}, None)) for token in tokens]
+        pairs = _pair_tags(tokens)
+        pos = 0
+        for i, (((start, end), kind, name), (local, attrib, content)) in enumerate(zip(matches, elements)):
+            if start > pos:
+                super().characters(data[pos:start])
+            pos = end
+            if local == _TEXT:
+                super().characters(content)
+            elif kind == TagKind.EMPTY:
+                if local not in _EMPTIES:
+                    local = 'x' if self.ns != XLIFF20_NS else 'ph'
+                self.write_element(local, attrib, empty=not content)
+                if content:
+                    super().characters(content)
+                    super().endElementNS((self.ns, local), local)
+            elif i in pairs and local in _PAIRED + (None,) and elements[pairs[i]][0] in _PAIRED + (None,):
+                local = local or elements[pairs[i]][0] or ('g' if self.ns != XLIFF20_NS else 'pc')
+                if kind == TagKind.START:
+                    self.write_element(local, attrib)
+                else:
+                    super().endElementNS((self.ns, local), local)
+            else:
+                self.write_element(*self.standalone_element(name, kind, local, attrib), empty=True)
+        if pos < len(data):
+            super().characters(data[pos:])
+        super().endElementNS(target_name, 'target')
+
+    def standalone_element(self, name, kind, local, attrib):
+        # a start or end tag that does not nest, written as bx/ex (1.2) or sc/ec (2.0)
+        if local in _STARTS + _ENDS:
+            return local, attrib
+        tag_id = attrib.get('id', name)
+        if self.ns == XLIFF20_NS:
+            if kind == TagKind.START:
+                return 'sc', {'id': tag_id}
+            return 'ec', {'startRef': tag_id}
+        if kind == TagKind.START:
+            return 'bx', {'id': tag_id, 'rid': tag_id}
+        return 'ex', {'id': tag_id, 'rid': tag_id}
+
+
+def write_xliff(source, destination, segments):
+    """Copy the XLIFF file source to destination, replacing the targets.
+
+    segments is an iterable of XliffSegments in document order, as yielded by
+    read_xliff(source); segments whose target is None, and the units that
+    read_xliff() skipped, keep the original target. Both files are streamed.
+    XML comments are not preserved.
+
+    """
+    writer = _XliffWriter(make_parser(), segments)
+    writer.setFeature(feature_namespaces, True)
+    with open(destination, 'w', encoding='utf-8') as out:
+        writer.setContentHandler(XMLGenerator(out, 'utf-8', short_empty_elements=True))
+        writer.parse(source)